@@ -3,7 +3,7 @@ from pathlib import Path
 
 import pandas as pd
 
-from modelutils import update_config_paths, evaluate_model
+from modelutils import update_config_paths, evaluate_scenarios, compare_stateful_simulation
 
 gauges = pd.read_csv(Path("data", "gauges.csv"), dtype={"gauge_id":str})
 
@@ -18,19 +18,20 @@ update_config_paths(run_id = "historical_conditions_0301_144142",
                     experiment_name = "historical", 
                     historical = True)
 
-# Evaluate trained model on historical and baseline scenarios
+# Evaluate trained model on historical and baseline scenarios in a single pass; the baseline (no water use) is applied to the historical dataset as it is evaluated
 import warnings
 
-experiments = ["historical", "baseline"]
+experiments = {"historical": None,
+               "baseline": {"combined_water_use": [0, pd.to_datetime("1980-10-01"), pd.to_datetime("2023-09-30")]}}
 
 with warnings.catch_warnings():
     warnings.simplefilter(action="ignore", category=FutureWarning)
     
-    for experiment in experiments:
-        evaluate_model(model_name = "historical_trained",
+    evaluate_scenarios(model_name = "historical_trained",
                        periods = ["train", "validation", "test"], 
                        epoch=30, 
-                       experiment_name = experiment)
+                       scenarios = experiments,
+                       base_experiment_name = "historical")
 
 # Performance across all benchmarking locations
 save_dir = Path("models", "DL", "outputs")
@@ -62,6 +63,14 @@ performance_metrics.groupby(["period", "experiment"], observed=True).median(nume
 # Performance at each benchmarking location
 performance_metrics.groupby(["period", "experiment", "gauge_id"], observed=True).median(numeric_only=True)
 
+# Divergence of stateful simulations (i.e., LSTM states carried through the record, O(T)) from windowed predictions in the test period
+stateful_divergence = compare_stateful_simulation(model_name = "historical_trained",
+                                                  epoch = 30,
+                                                  base_experiment_name = "historical",
+                                                  period = "test")
+
+stateful_divergence
+
 
 
 
@@ -76,16 +85,19 @@ update_config_paths(run_id = "historical_conditions_domain_0401_120614",
 # Evaluate trained model
 import warnings
 
-experiments = ["historical_domain", "baseline_domain", "baseline_modflow_domain"]
+experiments = {"historical_domain": None,
+               "baseline_domain": {"outside_irrigation": [0, pd.to_datetime("1980-10-01"), pd.to_datetime("2023-09-30")],
+                                   "modflow_irrigation": [0, pd.to_datetime("1980-10-01"), pd.to_datetime("2023-09-30")]},
+               "baseline_modflow_domain": {"modflow_irrigation": [0, pd.to_datetime("1980-10-01"), pd.to_datetime("2023-09-30")]}}
 
 with warnings.catch_warnings():
     warnings.simplefilter(action="ignore", category=FutureWarning)
     
-    for experiment in experiments:
-        evaluate_model(model_name = "historical_domain_trained",
+    evaluate_scenarios(model_name = "historical_domain_trained",
                        periods = ["train", "validation", "test"], 
                        epoch=30, 
-                       experiment_name = experiment)
+                       scenarios = experiments,
+                       base_experiment_name = "historical_domain")
 
 # Performance across all benchmarking locations
 save_dir = Path("models", "DL", "outputs")
@@ -117,32 +129,12 @@ performance_metrics.groupby(["period", "experiment"], observed=True).median(nume
 
 
 
-# experiment_names = ["historical", "baseline"]
-
-# experiments = {}
-
-# for experiment_name in experiment_names:
-
-#     experiment_folder = Path("model_comparison", "DL")
-    
-#     file_path = experiment_folder / f"{experiment_name}_timeseries.csv"
-    
-#     if file_path.exists():
-#         experiments[experiment_name] = pd.read_csv(file_path, dtype={"gauge_id": str}, parse_dates=["date"])
-#     else:
-#         print(f"{experiment_name} not found in {experiment_folder}.")
-
-# for i, experiment_name in enumerate(experiments):
-
-#     if i == 0:
-#         historical_conditions = (pd.Series(gauge_ids, name="gauge_id")
-#                                  .to_frame()
-#                                  .merge(experiments[experiment_name], on=["gauge_id"], how="left")
-#                                 )
-                                 
-#     else:
-#         historical_conditions = historical_conditions.merge(experiments[experiment_name], on=["gauge_id", "date", "baseflow_obs"], how="left")
+# from modelutils import read_evaluation_store
 
+# # simulated timeseries of both experiments (one row per gauge, date, and experiment), read from the store written by evaluate_scenarios()
+# historical_conditions = read_evaluation_store(save_dir / "DL_evaluation", 
+#                                               experiments = ["historical", "baseline"], 
+#                                               gauge_ids = gauge_ids)
 
 # historical_conditions
 
@@ -3,47 +3,16 @@ from pathlib import Path
 
 import pandas as pd
 
-from datautils import prepare_generic_dataset_folder
-from modelutils import evaluate_model
+from modelutils import evaluate_scenarios, compute_water_use_sensitivity
 
 gauges = pd.read_csv(Path("data", "gauges.csv"), dtype={"gauge_id":str})
 
 gauge_ids = gauges["gauge_id"]
 
-meteorological_variables = ["pr", "tmmn", "tmmx", "rmin", "rmax", "sph", "vs", "srad", "etr"]
 
-water_use_variables = ["combined_water_use"]
-
-attribute_variables = ["drainage_area", "elevation", "slope",
-                       "annual_precip", "annual_etr", "aridity",
-                       "annual_average_flow", "annual_max_flow", "annual_min_flow",
-                       "crop_cover", "irrigated_area", "pasture_cover", "forest_cover",
-                       "sand", "silt", "clay",
-                       "degree_regulated", "reserivor_volume", "river_area", "river_volume",
-                       "groundwater_depth", "land_surface_runoff",
-                       "gauge_id_encoded", "watershed_encoded"]
-
-target = ["baseflow"]
-
-dates = ["1980-10-01", "2023-09-30"]
-
-
-# Perturb water use by [0, 1.0, 0.1]
+# Perturb water use by [0, 1.0, 0.1]; perturbations are applied to the normalized historical dataset from 07_InputsforDLmodels.py, so no dataset folder is written per experiment
 pumping_fracs = [round(num * 0.10, 2) for num in range(10 + 1)]
-experiments = [f"sensitivity_experiment_{num}" for num in pumping_fracs]
-
-for frac, experiment in zip(pumping_fracs, experiments):
-    
-    prepare_generic_dataset_folder(gauge_ids = gauge_ids, 
-                                   experiment_name = experiment,
-                                   meteorological_variables = meteorological_variables,
-                                   water_use_variables = water_use_variables,
-                                   attribute_variables = attribute_variables,
-                                   target = target,
-                                   dates = dates,
-                                   historical = True,
-                                   variable_perturbations = {"combined_water_use": [frac, pd.to_datetime("1980-10-01"), pd.to_datetime("2023-09-30")]}
-                                  )
+experiments = {f"sensitivity_experiment_{num}": {"combined_water_use": [num, pd.to_datetime("1980-10-01"), pd.to_datetime("2023-09-30")]} for num in pumping_fracs}
 
 
 # Evaluate trained model with perturbed water use
@@ -52,16 +21,18 @@ import warnings
 with warnings.catch_warnings():
     warnings.simplefilter(action="ignore", category=FutureWarning)
     
-    for experiment in experiments:
-        evaluate_model(model_name = "historical_trained",
+    # all experiments are evaluated in a single pass with the model loaded once
+    evaluate_scenarios(model_name = "historical_trained",
                        periods = ["train", "validation", "test"], 
                        epoch=30, 
-                       experiment_name = experiment)
+                       scenarios = experiments,
+                       base_experiment_name = "historical")
 
 
 save_dir = Path("models", "DL", "outputs")
 
-performance_metrics = list(map(lambda path: pd.read_csv(path, dtype={"gauge_id": str}), [save_dir / "sensitivity_experiment_1.0_performance_metrics.csv", save_dir / "sensitivity_experiment_0.0_performance_metrics.csv"]))
+# performance metrics are saved for every experiment
+performance_metrics = list(map(lambda experiment: pd.read_csv(save_dir / f"{experiment}_performance_metrics.csv", dtype={"gauge_id": str}), experiments))
 
 performance_metrics = pd.concat(performance_metrics)
 
@@ -79,8 +50,25 @@ performance_metrics["period"] = pd.Categorical(
 
 performance_metrics["experiment"] = pd.Categorical(
     performance_metrics["experiment"],
-    categories=["sensitivity_experiment_1.0", "sensitivity_experiment_0.0"],
+    categories=list(experiments)[::-1],
     ordered=True
 )
 
-performance_metrics.groupby(["period", "experiment"], observed=True).median(numeric_only=True)
\ No newline at end of file
+performance_metrics.groupby(["period", "experiment"], observed=True).median(numeric_only=True)
+
+
+
+# Gradient sensitivity of baseflow to water use (i.e., one forward and backward pass instead of one evaluation per fraction)
+sensitivity = compute_water_use_sensitivity(model_name = "historical_trained",
+                                            epoch = 30,
+                                            variables = ["combined_water_use"],
+                                            period = "test",
+                                            base_experiment_name = "historical")
+
+sensitivity.to_netcdf(save_dir / "DL_water_use_sensitivity_test.nc")
+
+# local slope of the sensitivity experiments at a fraction of 1.0 [baseflow units per unit fraction], averaged over the test period at each gauge
+sensitivity["baseflow_fraction_sensitivity_combined_water_use"].mean("date").to_series()
+
+# lag attribution: how far back water use affects baseflow, averaged over gauges and days
+sensitivity["baseflow_sensitivity_combined_water_use"].mean(["gauge_id", "date"]).to_series()
@@ -1,8 +1,17 @@
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Tuple, Dict
 
 import pandas as pd
 
+# Process-level cache of raw inputs shared by every get_data() call (e.g., experiments in 07_InputsforDLmodels.py and 10_SensitivityAnalysis.py); least recently used tables are evicted past _INPUT_CACHE_MAX_BYTES
+# (inputs are read concurrently, see _read_meteorological_forcings(), so every access holds _INPUT_CACHE_LOCK; _INPUT_CACHE_BYTES is the running size of the cached tables)
+_INPUT_CACHE = OrderedDict()
+_INPUT_CACHE_MAX_BYTES = 4 * 1024**3
+_INPUT_CACHE_BYTES = 0
+_INPUT_CACHE_LOCK = threading.Lock()
+
 def get_data(gauge_ids : List[str],
              meteorological_variables : List[str],
              water_use_variables : List[str],
@@ -17,23 +26,24 @@ def get_data(gauge_ids : List[str],
     
     if isinstance(gauge_ids, str):
         gauge_ids = [gauge_ids]
+
+    # dates must be between the valid period of record
+    start_date = pd.to_datetime("1980-10-01"); end_date = pd.to_datetime("2023-09-30")
+    if dates is not None:
+        start_date = max(pd.to_datetime(dates[0]), start_date)
+        end_date = min(pd.to_datetime(dates[1]), end_date)
+
+    meteorological_forcings = _read_meteorological_forcings(gauge_ids, meteorological_variables, start_date, end_date)
     
-    meteorological_forcings = pd.DataFrame()
-    for gauge_id in gauge_ids:
-        meteorological_forcings = pd.concat([meteorological_forcings, 
-                                             pd.read_csv(Path("data", "climatepy", gauge_id + ".csv"), 
-                                                         usecols = ["gauge_id", "date"] + meteorological_variables,
-                                                         dtype={"gauge_id":str},
-                                                         parse_dates=["date"])])
-    
-    flow = pd.read_csv(Path("data", "flow.csv"), usecols = ["gauge_id", "date"] + target, dtype={"gauge_id": str}, parse_dates=["date"])
-    water_use = pd.read_csv(Path("data", "water_use.csv"), usecols = ["gauge_id", "year"] + water_use_variables, dtype={"gauge_id": str})
+    flow = _read_csv(Path("data", "flow.csv"), ["gauge_id", "date"] + target, start_date, end_date)
+    water_use = _read_csv(Path("data", "water_use.csv"), ["gauge_id", "year"] + water_use_variables)
     
     timeseries = (pd.Series(gauge_ids, name="gauge_id")
                   .to_frame()
-                  .merge(meteorological_forcings, on=["gauge_id"], how="left")
-                  .merge(flow, on=["gauge_id", "date"], how="left")
-                  .merge(water_use, left_on=["gauge_id", meteorological_forcings["date"].dt.year], 
+                  .merge(meteorological_forcings, on=["gauge_id"], how="inner")
+                  .merge(flow, on=["gauge_id", "date"], how="left"))
+    timeseries = (timeseries
+                  .merge(water_use, left_on=["gauge_id", timeseries["date"].dt.year], 
                      right_on=["gauge_id", "year"], how="left")
                   .drop(["year"], axis=1))
 
@@ -41,19 +51,6 @@ def get_data(gauge_ids : List[str],
         pass
         # placeholder to add support for future climate/management scenarios under a change factor (e.g., +/- 10% annual precip)
 
-    # dates must be between the valid period of record
-    period_start = pd.to_datetime("1980-10-01"); period_end = pd.to_datetime("2023-09-30")
-    if dates is None:
-         timeseries = timeseries[(timeseries["date"] >= period_start) & (timeseries["date"] <= period_end)].reset_index(drop=True)
-    else:
-        start_date = pd.to_datetime(dates[0])
-        end_date = pd.to_datetime(dates[1])
-        if start_date < period_start:
-            start_date = period_start
-        if end_date > period_end:
-            end_date = period_end
-        timeseries = timeseries[(timeseries["date"] >= start_date) & (timeseries["date"] <= end_date)].reset_index(drop=True)
-
     for var in water_use_variables:
         timeseries[var] = timeseries[var].where((timeseries["date"].dt.month >= 4) & (timeseries["date"].dt.month <= 9), 0) # set pumping to 0 where pumping season is False
 
@@ -66,12 +63,7 @@ def get_data(gauge_ids : List[str],
         pd.Series(gauge_ids, name="gauge_id")
         .to_frame()
         .merge(
-            pd.concat(
-                (pd.read_csv(file, dtype={"gauge_id": str}) for file in Path("data", "attributes").glob("*.csv")),
-                ignore_index=True
-            )
-            .groupby("gauge_id", as_index=False)
-            .first(),
+            _read_attributes(Path("data", "attributes"), Path("data", "attributes.parquet")),
             on="gauge_id",  
             how="left"      
         )
@@ -83,8 +75,162 @@ def get_data(gauge_ids : List[str],
 
 
 
-def generate_netcdf_files(data_dir : Path) -> Path:
-    """Generate netcdf files for neuralhydrology's GenericDataset class. 
+def _read_meteorological_forcings(gauge_ids : List[str],
+                                  meteorological_variables : List[str],
+                                  start_date : pd.Timestamp,
+                                  end_date : pd.Timestamp,
+                                  max_workers : int = None) -> pd.DataFrame:
+    """Read the meteorological forcings of every gauge from data/climatepy/<gauge_id>.csv concurrently and concatenate them once; helper for get_data()."""
+    import pyarrow as pa
+    from concurrent.futures import ThreadPoolExecutor
+
+    columns = ["gauge_id", "date"] + meteorological_variables
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tables = list(executor.map(lambda gauge_id: _read_csv(Path("data", "climatepy", gauge_id + ".csv"), columns, start_date, end_date, to_pandas=False), gauge_ids))
+
+    return pa.concat_tables(tables).to_pandas()
+
+
+def _read_csv(file : Path,
+              columns : List[str],
+              start_date : pd.Timestamp = None,
+              end_date : pd.Timestamp = None,
+              to_pandas : bool = True):
+    """Read only the given columns of a CSV file with explicit dtypes (gauge_id as str, date as datetime, year as int, everything else as float), keeping rows between start_date and end_date; helper for get_data()."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv
+
+    file = Path(file).resolve()
+    stat = file.stat()
+    key = ("csv", str(file), stat.st_mtime_ns, stat.st_size, tuple(columns), start_date, end_date)
+    table = _get_cached_input(key)
+    if table is not None:
+        return table.to_pandas() if to_pandas else table
+
+    column_types = {column: pa.float64() for column in columns}
+    column_types.update({"gauge_id": pa.string(), "date": pa.timestamp("ns"), "year": pa.int64()})
+
+    table = csv.read_csv(file, convert_options=csv.ConvertOptions(include_columns=columns, column_types=column_types))
+
+    # date window filtered before the table is converted to pandas
+    if start_date is not None:
+        table = table.filter(pc.greater_equal(table["date"], pa.scalar(start_date, type=pa.timestamp("ns"))))
+    if end_date is not None:
+        table = table.filter(pc.less_equal(table["date"], pa.scalar(end_date, type=pa.timestamp("ns"))))
+
+    _cache_input(key, table)
+    return table.to_pandas() if to_pandas else table
+
+
+def _read_attributes(attributes_dir : Path, attributes_file : Path) -> pd.DataFrame:
+    """Read the static attributes of every gauge merged from attributes_dir/*.csv (first non-null value of each attribute), saved once to the columnar attributes_file and rebuilt only when a CSV changes; helper for get_data()."""
+    import json
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    files = sorted(Path(attributes_dir).glob("*.csv"))
+    sources = json.dumps({file.name: [file.stat().st_size, file.stat().st_mtime_ns] for file in files})
+    key = ("attributes", str(Path(attributes_dir).resolve()), sources)
+    table = _get_cached_input(key)
+    if table is not None:
+        return table.to_pandas()
+
+    attributes_file = Path(attributes_file)
+    if attributes_file.exists() and (pq.read_schema(attributes_file).metadata or {}).get(b"sources") == sources.encode():
+        table = pq.read_table(attributes_file)
+    else:
+        attributes = (pd.concat((pd.read_csv(file, dtype={"gauge_id": str}) for file in files), ignore_index=True)
+                      .groupby("gauge_id", as_index=False)
+                      .first())
+        table = pa.Table.from_pandas(attributes, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"sources": sources.encode()})
+        pq.write_table(table, attributes_file)
+        print(f"    Merged static attributes saved to: {repr(attributes_file)}")
+
+    _cache_input(key, table)
+    return table.to_pandas()
+
+
+def _get_cached_input(key : Tuple):
+    """Get a table from the process-level input cache, marking it as most recently used; helper for _read_csv() and _read_attributes()."""
+    with _INPUT_CACHE_LOCK:
+        table = _INPUT_CACHE.get(key)
+        if table is not None:
+            _INPUT_CACHE.move_to_end(key)
+    return table
+
+
+def _cache_input(key : Tuple, table):
+    """Add a table to the process-level input cache and evict least recently used tables beyond _INPUT_CACHE_MAX_BYTES; helper for _read_csv() and _read_attributes()."""
+    global _INPUT_CACHE_BYTES
+
+    with _INPUT_CACHE_LOCK:
+        if key in _INPUT_CACHE:
+            _INPUT_CACHE_BYTES -= _INPUT_CACHE.pop(key).nbytes
+        _INPUT_CACHE[key] = table
+        _INPUT_CACHE_BYTES += table.nbytes
+        while len(_INPUT_CACHE) > 1 and _INPUT_CACHE_BYTES > _INPUT_CACHE_MAX_BYTES:
+            _INPUT_CACHE_BYTES -= _INPUT_CACHE.popitem(last=False)[1].nbytes
+
+
+def clear_input_cache():
+    """Clear the process-level cache of raw inputs read by get_data() (e.g., to free memory once every experiment folder is prepared)."""
+    global _INPUT_CACHE_BYTES
+
+    with _INPUT_CACHE_LOCK:
+        _INPUT_CACHE.clear()
+        _INPUT_CACHE_BYTES = 0
+
+
+
+
+def apply_variable_perturbations(timeseries : pd.DataFrame,
+                                 variable_perturbations : Dict,
+                                 verbose : bool = True) -> pd.DataFrame:
+    """Apply constant change factors to time-varying variables within a date range (e.g., no irrigation water use, +/- 10% annual precip).
+
+    Used to write perturbed dataset folders (see prepare_generic_dataset_folder()). Trained models instead simulate any number of scenarios from a single base dataset, 
+    with the same change factors applied to their normalized inputs (see modelutils.evaluate_scenarios()).
+
+    Parameters
+    ----------
+    timeseries : pd.DataFrame
+        Time-varying variables with a "date" column or a date index.
+    variable_perturbations : Dict
+        Dictionary of constant change factors with variable names as keys and a list containing change factor, start date, and end date, in that specific order, as values 
+        (e.g., {"combined_water_use": [0.5, "1980-10-01", "2023-09-30"]}).
+    verbose : bool, optional
+        Flag indicating whether to print each perturbation. By default True.
+
+    Returns
+    -------
+    pd.DataFrame
+        Copy of timeseries with perturbed variables.
+    """
+    timeseries = timeseries.copy()
+    dates = pd.to_datetime(timeseries["date"] if "date" in timeseries.columns else timeseries.index.get_level_values("date"))
+
+    for variable, values in variable_perturbations.items():
+        if variable in timeseries.columns:
+            perturbation_value = float(values[0])
+            start_date = pd.to_datetime(values[1]); end_date = pd.to_datetime(values[2])
+
+            date_range = (dates >= start_date) & (dates <= end_date)
+            timeseries.loc[date_range, variable] *= perturbation_value
+            
+            if verbose:
+                print(f"    '{variable}' perturbed by {perturbation_value} from {start_date} to {end_date}.")
+        elif verbose: 
+            print(f"    Warning: '{variable}' not found in timeseries variables.")
+
+    return timeseries
+
+
+
+
+def generate_netcdf_files(data_dir : Path, **netcdf_options) -> Path:
+    """Generate netcdf files for neuralhydrology's GenericDataset class from the CSV files saved in an experiment's data folder (i.e., prepare_generic_dataset_folder() with save_csv=True). 
     
     Only time-varying variables (i.e., meteorological forcings, water use, & target) are required as .nc files. 
 
@@ -92,39 +238,125 @@ def generate_netcdf_files(data_dir : Path) -> Path:
     ----------
     data_dir : Path
         Path to the folder specified in experiment_name. 
+    **netcdf_options
+        Keyword arguments passed to write_netcdf_files().
 
     Returns
     -------
     Path
         Path to folder where .nc files are saved to.
     """
-    
-    from xarray import Dataset, Variable
+    timeseries = pd.concat((pd.read_csv(file, dtype={"gauge_id":str}, parse_dates=["date"]) for file in (data_dir / "data").glob("*.csv")), ignore_index=True)
+
+    return write_netcdf_files(timeseries, data_dir / "time_series", **netcdf_options)
+
+
+def _hash_frame(frame : pd.DataFrame, parameters : Dict) -> str:
+    """Hash the contents and column names of a DataFrame along with build parameters; helper for prepare_generic_dataset_folder()."""
+    import hashlib
+    import json
+
+    sha256 = hashlib.sha256(json.dumps({"columns": list(frame.columns), "parameters": parameters}, sort_keys=True, default=str).encode())
+    sha256.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+
+    return sha256.hexdigest()
+
+
+def _read_manifest(data_dir : Path) -> Dict:
+    """Read an experiment folder's manifest.json, if any; helper for prepare_generic_dataset_folder()."""
+    import json
+
+    manifest_file = Path(data_dir) / "manifest.json"
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(data_dir : Path, manifest : Dict):
+    """Write an experiment folder's manifest.json, replacing it only once fully written; helper for prepare_generic_dataset_folder()."""
+    import json
+
+    manifest_file = Path(data_dir) / "manifest.json"
+    with open(manifest_file.with_suffix(".tmp"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    manifest_file.with_suffix(".tmp").replace(manifest_file)
+
+
+def write_netcdf_files(timeseries : pd.DataFrame,
+                       timeseries_path : Path,
+                       dtype : str = "float32",
+                       complevel : int = 4,
+                       chunksize : int = None,
+                       max_workers : int = None,
+                       use_processes : bool = False) -> Path:
+    """Write one netcdf file per gauge for neuralhydrology's GenericDataset class directly from memory.
+
+    Timeseries are split by gauge in a single groupby pass and each gauge's netcdf file is written by a pool of threads (or processes).
+
+    Parameters
+    ----------
+    timeseries : pd.DataFrame
+        Time-varying variables with "gauge_id" and "date" columns.
+    timeseries_path : Path
+        Folder where .nc files are saved to (i.e., the time_series folder of an experiment).
+    dtype : str, optional
+        Data type each variable is encoded as. By default "float32". None keeps the dtype of each column.
+    complevel : int, optional
+        zlib compression level from 1 to 9. By default 4. 0 or None disables compression.
+    chunksize : int, optional
+        Number of days per chunk along the date dimension. By default None (i.e., netcdf's default chunking).
+    max_workers : int, optional
+        Maximum number of files written at once. By default None (i.e., the executor's default).
+    use_processes : bool, optional
+        Flag indicating whether to write files with a pool of processes (True) or threads (False). By default False.
+
+    Returns
+    -------
+    Path
+        Path to folder where .nc files are saved to.
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    timeseries_path = Path(timeseries_path)
+    timeseries_path.mkdir(parents=True, exist_ok=True)
+
+    Executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with Executor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_write_netcdf_file, data.drop(columns=["gauge_id"]), timeseries_path / f"{gauge_id}.nc", dtype, complevel, chunksize)
+                   for gauge_id, data in timeseries.groupby("gauge_id", sort=False)]
+        for future in futures:
+            future.result()
 
-    data_path = data_dir / "data"
-    timeseries_path = data_dir / "time_series"
-    
-    for file in data_path.iterdir():
-        gauge_id = file.stem
-            
-        data = pd.read_csv(file, dtype={"gauge_id":str})
-        data["date"] = pd.to_datetime(data["date"])
-            
-        dataset = Dataset()
-            
-        for column in data.columns:
-            if column == "date":
-                dataset.coords["date"] = data[column].values
-            else:
-                dataset[column] = Variable("date", data[column].values)
-    
-        netcdf_file = timeseries_path / (gauge_id + ".nc")
-        dataset.to_netcdf(netcdf_file)
-        dataset.close()
     print(f"    Timeseries variables saved as netCDF files to: {repr(timeseries_path)}")
     return timeseries_path
 
 
+def _write_netcdf_file(data : pd.DataFrame,
+                       netcdf_file : Path,
+                       dtype : str = "float32",
+                       complevel : int = 4,
+                       chunksize : int = None):
+    """Write the timeseries of a single gauge to a netcdf file; helper for write_netcdf_files()."""
+    from xarray import Dataset
+
+    dataset = Dataset({column: ("date", data[column].to_numpy()) for column in data.columns if column != "date"},
+                      coords={"date": data["date"].to_numpy()})
+
+    encoding = {}
+    for variable in dataset.data_vars:
+        encoding[variable] = {}
+        if dtype is not None:
+            encoding[variable]["dtype"] = dtype
+        if complevel:
+            encoding[variable].update({"zlib": True, "complevel": complevel})
+        if chunksize:
+            encoding[variable]["chunksizes"] = (min(chunksize, len(data)),)
+
+    dataset.to_netcdf(netcdf_file, encoding=encoding)
+    dataset.close()
+
+
 
 
 def prepare_generic_dataset_folder(gauge_ids : List, 
@@ -135,13 +367,18 @@ def prepare_generic_dataset_folder(gauge_ids : List,
                                    target : List,
                                    dates : List,
                                    historical : bool=True,
-                                   variable_perturbations : Dict=None) -> Path:
+                                   variable_perturbations : Dict=None,
+                                   save_csv : bool=False,
+                                   netcdf_options : Dict=None,
+                                   rebuild : bool=False) -> Path:
     """Create a folder for neuralhydrology's GenericDataset class (https://neuralhydrology.readthedocs.io/en/latest/api/neuralhydrology.datasetzoo.genericdataset.html)
 
     All variable names passed will remain the same besides irrigation and target, which will be changed to "irrigation" and "baseflow", respectively. 
     This allows us to use a trained neuralhydrology model for forecasting future scenarios while retaining meaningful variable names in personal files. 
 
     If historical is False, then historical climate conditions are repeated until the end of the 21st century.
+    Builds are incremental: manifest.json in the folder records a hash of each gauge's inputs and of each attribute (along with the build parameters), 
+    so only gauges and attributes that changed since the last build are regenerated, and files of gauges or attributes no longer in the experiment are deleted.
     Use the variable_perturbations option to apply a constant change factor to the historical years (e.g., no irrigation water use, +/- 10% annual precip).
 
     Parameters
@@ -166,6 +403,12 @@ def prepare_generic_dataset_folder(gauge_ids : List,
         Dictionary of constant change factors (e.g.,  no irrigation water use, +/- 10% annual precip) to be applied for generating baseline or future climate scenarios. 
         Variable name must be the key and the values must be a list containing change factor, start date, and end date, in that specific order. 
         All variable names as keys will be the same as those in the provided lists above, besides irrigation and target, which will need to be named "water_use" and "baseflow", respectively. 
+    save_csv : bool, optional
+        Flag indicating whether to also save each gauge's timeseries as a CSV file in the data sub-folder. By default False (i.e., only netCDF files are saved).
+    netcdf_options : Dict, optional
+        Keyword arguments passed to write_netcdf_files() (e.g., {"dtype": "float32", "complevel": 4, "chunksize": 365, "max_workers": 8, "use_processes": False}). By default None (i.e., defaults of write_netcdf_files()).
+    rebuild : bool, optional
+        Flag indicating whether to regenerate every gauge and attribute regardless of the folder's manifest.json. By default False (i.e., only stale gauges and attributes are regenerated).
 
     Returns
     -------
@@ -188,7 +431,8 @@ def prepare_generic_dataset_folder(gauge_ids : List,
     print(f"Data folder created at: {repr(data_dir)}")
 
     # Required sub-folders
-    (data_dir / "data").mkdir(parents=True, exist_ok=True)
+    if save_csv:
+        (data_dir / "data").mkdir(parents=True, exist_ok=True)
     (data_dir / "time_series").mkdir(parents=True, exist_ok=True)
     (data_dir / "attributes").mkdir(parents=True, exist_ok=True)
 
@@ -206,39 +450,57 @@ def prepare_generic_dataset_folder(gauge_ids : List,
 
     # Apply variable pertrubations
     if variable_perturbations:
-        timeseries["date"] = pd.to_datetime(timeseries["date"])
+        timeseries = apply_variable_perturbations(timeseries, variable_perturbations)
 
-        for variable, values in variable_perturbations.items():
-            if variable in timeseries.columns:
-                perturbation_value = float(values[0])
-                start_date = values[1]; end_date = values[2]
+    
+    # Only gauges and attributes whose inputs or parameters changed since the last build are regenerated (see manifest.json)
+    manifest = {} if rebuild else _read_manifest(data_dir)
+    parameters = {"columns": list(timeseries.columns), "save_csv": save_csv, "netcdf_options": netcdf_options}
+
+    gauge_hashes = {str(gauge_id): _hash_frame(data, parameters) for gauge_id, data in timeseries.groupby("gauge_id", sort=False)}
+    gauge_outputs = {gauge_id: [f"time_series/{gauge_id}.nc"] + ([f"data/{gauge_id}.csv"] if save_csv else []) for gauge_id in gauge_hashes}
+    stale_gauges = [gauge_id for gauge_id, gauge_hash in gauge_hashes.items() 
+                    if manifest.get("gauges", {}).get(gauge_id) != gauge_hash or not all((data_dir / file).exists() for file in gauge_outputs[gauge_id])]
+    print(f"    Gauges to be regenerated: {len(stale_gauges)}/{len(gauge_hashes)}")
 
-                date_range = (timeseries["date"] >= start_date) & (timeseries["date"] <= end_date)
-                timeseries.loc[date_range, variable] *= perturbation_value
-                
-                print(f"    '{variable}' perturbed by {perturbation_value} from {start_date} to {end_date}.")
-            else: 
-                print(f"    Warning: '{variable}' not found in timeseries variables.")
 
-    
     # 2. Save forcings 
-    def save_forcings(gauge_id):
-         timeseries[timeseries["gauge_id"] == gauge_id].to_csv(Path(data_dir / "data", f"{gauge_id}.csv"), index=False)
-    list(map(save_forcings, gauge_ids))
+    stale_timeseries = timeseries[timeseries["gauge_id"].isin(stale_gauges)]
+    if save_csv:
+        for gauge_id, data in stale_timeseries.groupby("gauge_id", sort=False):
+            data.to_csv(Path(data_dir / "data", f"{gauge_id}.csv"), index=False)
 
-    data_path = data_dir / "data"
-    print(f"    Timeseries variables saved to: {repr(data_path)}")
+        data_path = data_dir / "data"
+        print(f"    Timeseries variables saved to: {repr(data_path)}")
 
-    timeseries_path = generate_netcdf_files(data_dir)
+    if stale_gauges:
+        # prints where the netCDF files are saved to
+        write_netcdf_files(stale_timeseries, data_dir / "time_series", **(netcdf_options or {}))
 
     
     # 3. Save attributes
+    attribute_hashes = {attribute: _hash_frame(attributes[["gauge_id", attribute]], {}) for attribute in attributes.columns if attribute != "gauge_id"}
+    stale_attributes = [attribute for attribute, attribute_hash in attribute_hashes.items()
+                        if manifest.get("attributes", {}).get(attribute) != attribute_hash or not (data_dir / "attributes" / f"{attribute}.csv").exists()]
+
     def save_attributes(attribute):
         attributes[["gauge_id", attribute]].to_csv(Path(data_dir / "attributes", f"{attribute}.csv"), index=False)
 
-    list(map(save_attributes, [i for i in attributes.columns if i != "gauge_id"]))
+    list(map(save_attributes, stale_attributes))
         
     attributes_path = data_dir / "attributes"
     print(f"    Static variables saved to: {repr(attributes_path)}")
+
+
+    # 4. Delete outputs that are no longer part of the experiment (e.g., removed gauges or attributes) and save the manifest
+    outputs = {file for files in gauge_outputs.values() for file in files} | {f"attributes/{attribute}.csv" for attribute in attribute_hashes}
+    orphans = [file for folder, pattern in [("time_series", "*.nc"), ("data", "*.csv"), ("attributes", "*.csv")] 
+               for file in (data_dir / folder).glob(pattern) if file.relative_to(data_dir).as_posix() not in outputs]
+    for file in orphans:
+        file.unlink()
+    if orphans:
+        print(f"    Orphaned files deleted: {len(orphans)}")
+
+    _write_manifest(data_dir, {"gauges": gauge_hashes, "attributes": attribute_hashes})
     
     return data_dir
\ No newline at end of file
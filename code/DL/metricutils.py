@@ -0,0 +1,214 @@
+from typing import List, Tuple, Dict
+
+import numpy as np
+import pandas as pd
+
+# Metrics computed by calculate_metrics(), named as in neuralhydrology's config metrics; the depletion metrics need baseline and depletion_obs
+METRICS = ["NSE", "KGE", "RMSE", "Pearson-r", "Alpha-NSE", "Beta-NSE", "FHV", "FMS", "FLV", "Depletion-RMSE", "Depletion-Bias"]
+
+def get_metrics_arrays(timeseries : pd.DataFrame,
+                       target : str = "baseflow",
+                       experiments : List[str] = None,
+                       gauge_ids : List[str] = None) -> Tuple[np.ndarray, np.ndarray, List[str], List[str], np.ndarray]:
+    """Arrange simulated timeseries of several experiments (e.g., from modelutils.read_evaluation_store()) as observation and simulation arrays for calculate_metrics().
+
+    Days that a gauge has no timeseries for are NaN, so gauges with different records share a single date axis.
+
+    Parameters
+    ----------
+    timeseries : pd.DataFrame
+        Timeseries with columns gauge_id, date, experiment, {target}_obs, and {target}_sim.
+    target : str, optional
+        Target variable. By default "baseflow".
+    experiments : List[str], optional
+        Experiments in the order of the first axis of the simulations. By default None (i.e., in order of appearance).
+    gauge_ids : List[str], optional
+        Gauges in the order of the gauge axis. By default None (i.e., in order of appearance).
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, List[str], List[str], np.ndarray]
+        Observations (gauge, time), simulations (experiment, gauge, time), experiments, gauge ids, and dates.
+    """
+    experiments = list(pd.unique(timeseries["experiment"])) if experiments is None else list(experiments)
+    gauge_ids = list(pd.unique(timeseries["gauge_id"])) if gauge_ids is None else list(gauge_ids)
+    dates = np.unique(timeseries["date"].to_numpy())
+
+    e = pd.Index(experiments).get_indexer(timeseries["experiment"])
+    g = pd.Index(gauge_ids).get_indexer(timeseries["gauge_id"])
+    t = np.searchsorted(dates, timeseries["date"].to_numpy())
+    keep = (e >= 0) & (g >= 0)
+
+    obs = np.full((len(gauge_ids), len(dates)), np.nan)
+    sim = np.full((len(experiments), len(gauge_ids), len(dates)), np.nan)
+    obs[g[keep], t[keep]] = timeseries[f"{target}_obs"].to_numpy()[keep]
+    sim[e[keep], g[keep], t[keep]] = timeseries[f"{target}_sim"].to_numpy()[keep]
+
+    return obs, sim, experiments, gauge_ids, dates
+
+
+def calculate_metrics(obs : np.ndarray,
+                      sim : np.ndarray,
+                      metrics : List[str] = None,
+                      baseline : np.ndarray = None,
+                      depletion_obs : np.ndarray = None,
+                      clip_to_zero : bool = False) -> Dict[str, np.ndarray]:
+    """Calculate performance metrics of any number of experiments and gauges in a single batched pass over the time axis.
+
+    Metrics follow neuralhydrology.evaluation.metrics (e.g., NSE, KGE, FHV/FMS/FLV with their default thresholds) and are computed over the days where observations and simulations are both valid.
+    Metrics that cannot be computed (e.g., no valid days) are NaN. Peak-Timing and Missed-Peaks are not supported.
+    Depletion metrics compare simulated streamflow depletion (i.e., sim - baseline, with negative values for depletion as in 11_SensitivityAnalysis.R) against a reference depletion
+    (e.g., streamflow depletion from the MODFLOW model): Depletion-RMSE and Depletion-Bias, the total depletion bias in percent.
+
+    Parameters
+    ----------
+    obs : np.ndarray
+        Observations with time as the last axis (e.g., (gauge, time)); broadcast against sim.
+    sim : np.ndarray
+        Simulations with time as the last axis (e.g., (experiment, gauge, time)).
+    metrics : List[str], optional
+        Metrics to calculate, see METRICS. By default None (i.e., every metric that the inputs allow).
+    baseline : np.ndarray, optional
+        Baseline simulations (e.g., no water use) broadcast against sim, for depletion metrics. By default None.
+    depletion_obs : np.ndarray, optional
+        Reference streamflow depletion broadcast against sim, for depletion metrics. By default None.
+    clip_to_zero : bool, optional
+        Flag indicating whether to clip negative simulations to zero, as for targets in the config's clip_targets_to_zero. By default False.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        Dictionary with metric names as keys and arrays of sim's shape without the time axis as values.
+    """
+    import warnings
+
+    if metrics is None:
+        metrics = [metric for metric in METRICS if not metric.startswith("Depletion") or (baseline is not None and depletion_obs is not None)]
+    unknown = [metric for metric in metrics if metric not in METRICS]
+    if unknown:
+        raise ValueError(f"Metrics {unknown} are not supported, must be in {METRICS}.")
+
+    sim = np.asarray(sim, dtype=np.float64)
+    if clip_to_zero:
+        sim = np.where(sim < 0, 0, sim)
+        baseline = None if baseline is None else np.where(np.asarray(baseline) < 0, 0, baseline)
+    obs, sim = np.broadcast_arrays(np.asarray(obs, dtype=np.float64), sim)
+    depletion = None if baseline is None else sim - np.asarray(baseline, dtype=np.float64)
+
+    # only days with valid observations and simulations
+    valid = ~np.isnan(obs) & ~np.isnan(sim)
+    n = valid.sum(axis=-1)
+    obs = np.where(valid, obs, np.nan)
+    sim = np.where(valid, sim, np.nan)
+
+    values = {}
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        # all-NaN series (e.g., gauges without observations in a period) are NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        obs_mean = np.nanmean(obs, axis=-1, keepdims=True)
+        sim_mean = np.nanmean(sim, axis=-1, keepdims=True)
+        obs_std = np.nanstd(obs, axis=-1)
+        sim_std = np.nanstd(sim, axis=-1)
+        r = np.nanmean((obs - obs_mean) * (sim - sim_mean), axis=-1) / (obs_std * sim_std)
+        r = np.where(n >= 2, r, np.nan)
+        obs_mean = obs_mean[..., 0]; sim_mean = sim_mean[..., 0]
+
+        for metric in metrics:
+            if metric == "NSE":
+                values[metric] = 1 - np.nansum((sim - obs)**2, axis=-1) / np.nansum((obs - obs_mean[..., None])**2, axis=-1)
+            elif metric == "RMSE":
+                values[metric] = np.sqrt(np.nanmean((sim - obs)**2, axis=-1))
+            elif metric == "Pearson-r":
+                values[metric] = r
+            elif metric == "KGE":
+                values[metric] = 1 - np.sqrt((r - 1)**2 + (sim_std / obs_std - 1)**2 + (sim_mean / obs_mean - 1)**2)
+            elif metric == "Alpha-NSE":
+                values[metric] = sim_std / obs_std
+            elif metric == "Beta-NSE":
+                values[metric] = (sim_mean - obs_mean) / obs_std
+            elif metric in ["FHV", "FMS", "FLV"]:
+                values[metric] = _fdc_metric(metric, obs, sim, n)
+            elif metric in ["Depletion-RMSE", "Depletion-Bias"]:
+                if baseline is None or depletion_obs is None:
+                    raise ValueError(f"{metric} needs both baseline and depletion_obs.")
+                # days with valid simulated and reference depletion, regardless of observations
+                error = depletion - np.asarray(depletion_obs, dtype=np.float64)
+                reference = np.where(np.isnan(error), np.nan, depletion_obs)
+                if metric == "Depletion-RMSE":
+                    values[metric] = np.sqrt(np.nanmean(error**2, axis=-1))
+                else:
+                    values[metric] = 100 * np.nansum(error, axis=-1) / np.abs(np.nansum(reference, axis=-1))
+                continue
+            # no valid days
+            values[metric] = np.where(n > 0, values[metric], np.nan)
+
+    return values
+
+
+def metrics_to_dataframe(values : Dict[str, np.ndarray],
+                         experiments : List[str],
+                         gauge_ids : List[str]) -> pd.DataFrame:
+    """Convert (experiment, gauge) arrays of metrics from calculate_metrics() to a table with one row per experiment and gauge.
+
+    Parameters
+    ----------
+    values : Dict[str, np.ndarray]
+        Dictionary with metric names as keys and (experiment, gauge) arrays as values.
+    experiments : List[str]
+        Experiments along the first axis.
+    gauge_ids : List[str]
+        Gauges along the second axis.
+
+    Returns
+    -------
+    pd.DataFrame
+        Metrics with columns gauge_id, experiment, and one column per metric.
+    """
+    performance_metrics = pd.DataFrame({"gauge_id": np.tile(gauge_ids, len(experiments)),
+                                        "experiment": np.repeat(experiments, len(gauge_ids))})
+    for metric, value in values.items():
+        performance_metrics[metric] = np.asarray(value).ravel()
+
+    return performance_metrics
+
+
+def _fdc_metric(metric : str,
+                obs : np.ndarray,
+                sim : np.ndarray,
+                n : np.ndarray,
+                h : float = 0.02,
+                l : float = 0.3,
+                lower : float = 0.2,
+                upper : float = 0.7) -> np.ndarray:
+    """Calculate FHV, FMS, or FLV of flow duration curves with NaNs past each series' n valid days; helper for calculate_metrics()."""
+    # flow duration curves sorted in descending order, NaNs last
+    obs = -np.sort(-obs, axis=-1)
+    sim = -np.sort(-sim, axis=-1)
+    rank = np.arange(obs.shape[-1])
+
+    if metric == "FHV":
+        top = rank < np.round(h * n)[..., None]
+        return 100 * np.sum(np.where(top, sim - obs, 0), axis=-1) / np.sum(np.where(top, obs, 0), axis=-1)
+
+    # for numerical reasons change 0s to 1e-6. Simulations can still contain negatives, so also reset those.
+    sim = np.where(sim <= 0, 1e-6, sim)
+    obs = np.where(obs == 0, 1e-6, obs)
+
+    if metric == "FMS":
+        def _log_flow(fdc, fraction):
+            index = np.minimum(np.round(fraction * n).astype(int), np.maximum(n - 1, 0))
+            return np.log(np.take_along_axis(fdc, index[..., None], axis=-1)[..., 0])
+
+        qsm = _log_flow(sim, lower) - _log_flow(sim, upper)
+        qom = _log_flow(obs, lower) - _log_flow(obs, upper)
+        return 100 * (qsm - qom) / (qom + 1e-6)
+
+    # lowest l fraction of valid flows in log scale, i.e., the last round(l * n) of each series' n valid days (or all of them if that rounds to 0, like fdc[-0:])
+    count = np.round(l * n)
+    start = np.where(count > 0, n - count, 0)
+    low = (rank >= start[..., None]) & (rank < n[..., None])
+    obs = np.where(low, np.log(obs), np.nan)
+    sim = np.where(low, np.log(sim), np.nan)
+    qsl = np.nansum(sim - np.nanmin(sim, axis=-1, keepdims=True), axis=-1)
+    qol = np.nansum(obs - np.nanmin(obs, axis=-1, keepdims=True), axis=-1)
+    return -100 * (qsl - qol) / (qol + 1e-6)
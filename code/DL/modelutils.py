@@ -1,5 +1,7 @@
 from pathlib import Path
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Iterator, Union
+
+import pandas as pd
 
 def update_config_paths(run_id : str,
                         model_name : str,
@@ -136,59 +138,778 @@ def evaluate_model(model_name : str,
                    periods : List[str], 
                    epoch : int,
                    experiment_name : str,
-                   historical : bool=True):
+                   historical : bool=True,
+                   base_experiment_name : str=None,
+                   variable_perturbations : Dict=None):
+    """Evaluate a trained neuralhydrology model on an experiment and save its timeseries (and performance metrics) to models/DL/outputs.
+
+    Single-experiment shortcut for evaluate_scenarios(); use that directly to evaluate several experiments on the same dataset folder with a single model load.
+
+    Parameters
+    ----------
+    model_name : str
+        Trained model name. 
+    periods : List[str]
+        Periods to evaluate (i.e., "train", "validation", and/or "test").
+    epoch : int
+        Epoch of the model weights to evaluate.
+    experiment_name : str
+        Name of the experiment, used for output files; also the dataset folder unless base_experiment_name is provided.
+    historical : bool, optional
+        Flag indicating whether to use folder for historical conditions (True) or future scenarios (False). By default True.
+    base_experiment_name : str, optional
+        Name of the dataset folder that variable_perturbations are applied to. By default None (i.e., experiment_name).
+    variable_perturbations : Dict, optional
+        Dictionary of constant change factors, as in datautils.prepare_generic_dataset_folder(). By default None (i.e., no perturbations).
+    """
+    evaluate_scenarios(model_name,
+                       periods = periods,
+                       epoch = epoch,
+                       scenarios = {experiment_name: variable_perturbations},
+                       base_experiment_name = base_experiment_name or experiment_name,
+                       historical = historical)
+
 
+def evaluate_scenarios(model_name : str,
+                       periods : List[str],
+                       epoch : int,
+                       scenarios : Dict[str, Dict],
+                       base_experiment_name : str="historical",
+                       historical : bool=True,
+                       batch_size : int=None,
+                       stateful : bool=False,
+                       append : bool=False) -> Path:
+    """Evaluate a trained neuralhydrology model on several experiments in a single pass and save their timeseries (and performance metrics) to models/DL/outputs.
+
+    See iter_scenarios() for how the experiments are simulated. Timeseries are streamed gauge by gauge into the DL_evaluation store (see write_evaluation_store()), 
+    so memory does not grow with the number of gauges, periods, or experiments. Performance metrics of every experiment are then computed from the store in one batched pass per period 
+    (see metricutils.calculate_metrics()); metrics in the config that metricutils does not support (e.g., Peak-Timing) are skipped.
+
+    Parameters
+    ----------
+    model_name : str
+        Trained model name. 
+    periods : List[str]
+        Periods to evaluate (i.e., "train", "validation", and/or "test").
+    epoch : int
+        Epoch of the model weights to evaluate.
+    scenarios : Dict[str, Dict]
+        Dictionary with experiment names as keys and variable perturbations as values, as in datautils.apply_variable_perturbations() 
+        (e.g., {"historical": None, "baseline": {"combined_water_use": [0, "1980-10-01", "2023-09-30"]}}).
+    base_experiment_name : str, optional
+        Name of the dataset folder the scenarios are applied to. By default "historical".
+    historical : bool, optional
+        Flag indicating whether to use folder for historical conditions (True) or future scenarios (False). By default True.
+    batch_size : int, optional
+        Number of input windows per experiment in each forward pass. By default None (i.e., the batch_size of the model config).
+    stateful : bool, optional
+        Flag indicating whether to carry the LSTM states through each gauge's record instead of evaluating overlapping windows. By default False.
+    append : bool, optional
+        Flag indicating whether to keep timeseries already stored for these experiments (e.g., to add periods or gauges), in which case metrics are computed over every period stored for them. 
+        By default False (i.e., they are replaced).
+
+    Returns
+    -------
+    Path
+        Folder of the DL_evaluation store.
+    """
     from pathlib import Path
-    import pickle
+    import shutil
     import pandas as pd
-    from neuralhydrology.nh_run import eval_run
+    from neuralhydrology.utils.config import Config
+    from metricutils import METRICS, get_metrics_arrays, calculate_metrics, metrics_to_dataframe
 
-    # model run directory on main computer 
-    run_dir = Path("models", "DL") / model_name
+    cfg = Config(Path("models", "DL") / model_name / "config.yml")
+    targets = cfg.target_variables
+    metrics = None if "all" in cfg.metrics else [metric for metric in cfg.metrics if metric in METRICS]
 
-    # set config path to experiment run dir
-    update_config_data_dir(model_name,
-                           experiment_name = experiment_name, 
-                           historical = historical)
-    
     # save folder
     save_folder = Path("models", "DL", "outputs")
     save_folder.mkdir(parents=True, exist_ok=True)
-    
-    # evaluate trained model
-    for period in periods:
-        eval_run(run_dir=run_dir, period=period, epoch=epoch, gpu=-1)
+    store_path = save_folder / "DL_evaluation"
 
-    # combine per period output into a single pickle file and timeseries and save to model-comparison folder
-    eval_files = {}
-    timeseries = []
-    
+    if not append:
+        for experiment in scenarios:
+            shutil.rmtree(store_path / f"experiment={experiment}", ignore_errors=True)
+
+    for timeseries in iter_scenarios(model_name,
+                                     periods = periods,
+                                     epoch = epoch,
+                                     scenarios = scenarios,
+                                     base_experiment_name = base_experiment_name,
+                                     historical = historical,
+                                     batch_size = batch_size,
+                                     stateful = stateful):
+        write_evaluation_store(timeseries, store_path)
+
+    # with append, the metrics files also cover periods stored by earlier calls, since they are rewritten below
+    metric_periods = list(periods)
+    if append:
+        stored_periods = read_evaluation_store(store_path, experiments=list(scenarios), columns=["period"])["period"]
+        metric_periods += [period for period in pd.unique(stored_periods) if period not in metric_periods]
+
+    # performance metrics of every experiment and gauge in one batched pass per period and target
+    performance_metrics = []
+    for period in metric_periods:
+        timeseries = read_evaluation_store(store_path, experiments=list(scenarios), periods=[period])
+        if timeseries.empty:
+            continue
+
+        period_experiments = [experiment for experiment in scenarios if experiment in set(timeseries["experiment"])]
+        period_metrics = None
+        for target in targets:
+            obs, sim, experiments, gauge_ids, _ = get_metrics_arrays(timeseries, target=target, experiments=period_experiments)
+            values = calculate_metrics(obs, sim, metrics=metrics, clip_to_zero=target in cfg.clip_targets_to_zero)
+            if len(targets) > 1:
+                values = {f"{target}_{metric}": value for metric, value in values.items()}
+            target_metrics = metrics_to_dataframe(values, experiments, gauge_ids)
+            period_metrics = target_metrics if period_metrics is None else period_metrics.merge(target_metrics, on=["gauge_id", "experiment"])
+        period_metrics["period"] = period
+        performance_metrics.append(period_metrics)
+    performance_metrics = pd.concat(performance_metrics, ignore_index=True)
+    performance_metrics = performance_metrics[["gauge_id"] + [column for column in performance_metrics.columns if column not in ["gauge_id", "period", "experiment"]] + ["period", "experiment"]]
+
+    # save peformance metrics of each experiment to model-comparison folder
+    for experiment, experiment_metrics in performance_metrics.groupby("experiment", sort=False):
+        experiment_metrics.to_csv(save_folder / f"{experiment}_performance_metrics.csv", index=False)
+
+    return store_path
+
+
+def simulate_scenarios(model_name : str,
+                       periods : List[str],
+                       epoch : int,
+                       scenarios : Dict[str, Dict],
+                       base_experiment_name : str="historical",
+                       historical : bool=True,
+                       batch_size : int=None,
+                       stateful : bool=False) -> pd.DataFrame:
+    """Simulate several experiments with a trained neuralhydrology model in a single pass and return all of their timeseries (see iter_scenarios()).
+
+    Parameters
+    ----------
+    model_name : str
+        Trained model name. 
+    periods : List[str]
+        Periods to simulate (i.e., "train", "validation", and/or "test").
+    epoch : int
+        Epoch of the model weights to use.
+    scenarios : Dict[str, Dict]
+        Dictionary with experiment names as keys and variable perturbations as values, as in datautils.apply_variable_perturbations().
+    base_experiment_name : str, optional
+        Name of the dataset folder the scenarios are applied to. By default "historical".
+    historical : bool, optional
+        Flag indicating whether to use folder for historical conditions (True) or future scenarios (False). By default True.
+    batch_size : int, optional
+        Number of input windows per experiment in each forward pass. By default None (i.e., the batch_size of the model config).
+    stateful : bool, optional
+        Flag indicating whether to carry the LSTM states through each gauge's record instead of evaluating overlapping windows. By default False.
+
+    Returns
+    -------
+    pd.DataFrame
+        Observed and simulated target(s) for every experiment with columns gauge_id, date, period, experiment, {target}_obs, and {target}_sim.
+    """
+    import pandas as pd
+
+    return pd.concat(iter_scenarios(model_name,
+                                    periods = periods,
+                                    epoch = epoch,
+                                    scenarios = scenarios,
+                                    base_experiment_name = base_experiment_name,
+                                    historical = historical,
+                                    batch_size = batch_size,
+                                    stateful = stateful), ignore_index=True)
+
+
+def iter_scenarios(model_name : str,
+                   periods : List[str],
+                   epoch : int,
+                   scenarios : Dict[str, Dict],
+                   base_experiment_name : str="historical",
+                   historical : bool=True,
+                   batch_size : int=None,
+                   stateful : bool=False) -> Iterator[pd.DataFrame]:
+    """Simulate several experiments with a trained neuralhydrology model in a single pass, yielding the timeseries of one gauge and period at a time.
+
+    The model weights, scalers and each gauge's normalized dataset are loaded once. Each experiment is a set of constant change factors applied to the normalized inputs of 
+    base_experiment_name (i.e., (factor * x - center) / scale), and the inputs of all experiments are stacked along the batch dimension so each batch is a single forward pass. 
+    The config is updated in memory, so config.yml is left untouched.
+
+    With stateful, a cudalstm model spins up over the first seq_length days of each gauge's record and then carries its hidden and cell states forward through the rest of the record, 
+    so each day is computed once (i.e., O(T) instead of O(T * seq_length)). Predictions after the first one differ from the windowed predictions the model was trained on, 
+    because states are no longer reset seq_length days back (see compare_stateful_simulation()). Days with missing inputs (e.g., gaps in the forcings) are not predicted,
+    and the states restart after each gap, spinning up again over the next seq_length days as the windowed predictions do.
+
+    Parameters
+    ----------
+    model_name : str
+        Trained model name. 
+    periods : List[str]
+        Periods to simulate (i.e., "train", "validation", and/or "test").
+    epoch : int
+        Epoch of the model weights to use.
+    scenarios : Dict[str, Dict]
+        Dictionary with experiment names as keys and variable perturbations as values, as in datautils.apply_variable_perturbations() 
+        (e.g., {"historical": None, "baseline": {"combined_water_use": [0, "1980-10-01", "2023-09-30"]}}).
+    base_experiment_name : str, optional
+        Name of the dataset folder the scenarios are applied to. By default "historical".
+    historical : bool, optional
+        Flag indicating whether to use folder for historical conditions (True) or future scenarios (False). By default True.
+    batch_size : int, optional
+        Number of input windows per experiment in each forward pass. By default None (i.e., the batch_size of the model config).
+    stateful : bool, optional
+        Flag indicating whether to carry the LSTM states through each gauge's record instead of evaluating overlapping windows. By default False.
+
+    Yields
+    ------
+    pd.DataFrame
+        Observed and simulated target(s) of one gauge and period for every experiment with columns gauge_id, date, period, experiment, {target}_obs, and {target}_sim.
+    """
+    import numpy as np
+    import pandas as pd
+    import torch
+    from torch.utils.data import DataLoader
+    from neuralhydrology.datasetzoo import get_dataset
+    from neuralhydrology.datautils.utils import load_basin_file
+    from neuralhydrology.utils.errors import NoEvaluationDataError
+
+    # load model weights and scalers once for all periods and experiments
+    cfg, model, scaler, id_to_int, additional_features = _load_trained_model(model_name, epoch, base_experiment_name, historical)
+    device = torch.device(cfg.device)
+
+    if stateful and cfg.model != "cudalstm":
+        raise ValueError(f"Stateful simulation is only implemented for cudalstm models, not {cfg.model}.")
+
+    targets = cfg.target_variables
+    target_scale = scaler["xarray_feature_scale"][targets].to_array().values
+    target_center = scaler["xarray_feature_center"][targets].to_array().values
+
+    experiments = list(scenarios.keys())
+    perturbations = _get_normalized_perturbations(cfg, scaler, scenarios)
+    batch_size = batch_size or cfg.batch_size
+
+    # simulate all experiments for each period and gauge
     for period in periods:
-        with open(run_dir / period / f"model_epoch{str(epoch).zfill(3)}" / f"{period}_results.p", "rb") as fp:
-            eval_files[period] = pickle.load(fp)
-
-        for gauge_id, values in eval_files[period].items():
-            df = values["1D"]["xr"].to_dataframe().reset_index().drop(columns=["time_step"]) 
-            df["gauge_id"] = gauge_id
-            df = df[["gauge_id", "date", "baseflow_obs", "baseflow_sim"]]
-            timeseries.append(df)
-    
-    timeseries = pd.concat(timeseries, ignore_index=True)
-    timeseries.rename(columns={"baseflow_sim": f"baseflow_sim_{experiment_name}"}, inplace=True)
-    timeseries.to_csv(save_folder / f"{experiment_name}_timeseries.csv", index=False)
-    
-    with open(save_folder / f"{experiment_name}.p", "wb") as fp:
-        pickle.dump(eval_files, fp)
-
-    # save peformance metrics for historical and baseline experiments to model-comparison folder
-    if experiment_name in ["historical", "baseline", "historical_domain", "baseline_domain", "baseline_modflow_domain", "sensitivity_experiment_0.0", "sensitivity_experiment_1.0"]:
-        performance_metrics = []
-        for period in periods:
-            period_metrics = pd.read_csv(run_dir / period / f"model_epoch{str(epoch).zfill(3)}" / f"{period}_metrics.csv", dtype={"basin":str})
-            period_metrics.rename(columns={"basin": "gauge_id"}, inplace=True)
-            period_metrics["period"] = period
-            performance_metrics.append(period_metrics)
-        performance_metrics = pd.concat(performance_metrics)
-        performance_metrics["experiment"] = experiment_name
-        performance_metrics.to_csv(save_folder / f"{experiment_name}_performance_metrics.csv", index=False)
+        print(f"Simulating {len(experiments)} experiment(s) in the {period} period")
+        for gauge_id in load_basin_file(getattr(cfg, f"{period}_basin_file")):
+            try:
+                ds = get_dataset(cfg=cfg,
+                                 is_train=False,
+                                 period=period,
+                                 basin=gauge_id,
+                                 additional_features=additional_features,
+                                 id_to_int=id_to_int,
+                                 scaler=scaler)
+            except NoEvaluationDataError:
+                continue
+
+            with torch.no_grad():
+                if stateful:
+                    data, indices = _get_record(ds)
+                    obs = data["y"][0, indices, :].numpy()
+                    dates = data["date"][0, indices]
+                    data = _stack_scenarios(data, perturbations, device)
+                    data = model.pre_model_hook(data, is_train=False)
+                    sims = _run_stateful(model, data, cfg.seq_length)[:, indices, :].cpu().numpy()
+                else:
+                    loader = DataLoader(ds, batch_size=batch_size, shuffle=False, num_workers=0, collate_fn=ds.collate_fn)
+
+                    sims, obs, dates = [], [], []
+                    for data in loader:
+                        obs.append(data["y"][:, -1, :].numpy())
+                        dates.append(data["date"][:, -1])
+                        data = _stack_scenarios(data, perturbations, device)
+                        data = model.pre_model_hook(data, is_train=False)
+                        y_hat = model(data)["y_hat"][:, -1, :].cpu().numpy()
+                        sims.append(y_hat.reshape(len(experiments), -1, len(targets)))
+                    sims = np.concatenate(sims, axis=1)
+                    obs = np.concatenate(obs, axis=0)
+                    dates = np.concatenate(dates)
+
+            # rescale predictions and observations of the last time step
+            sims = sims * target_scale + target_center
+            obs = obs * target_scale + target_center
+
+            timeseries = pd.DataFrame({"gauge_id": gauge_id,
+                                       "date": np.tile(dates, len(experiments)),
+                                       "period": period,
+                                       "experiment": np.repeat(experiments, len(dates))})
+            for i, target in enumerate(targets):
+                timeseries[f"{target}_obs"] = np.tile(obs[:, i], len(experiments))
+                timeseries[f"{target}_sim"] = sims[:, :, i].ravel()
+
+            yield timeseries
+
+
+def compare_stateful_simulation(model_name : str,
+                                epoch : int,
+                                base_experiment_name : str="historical",
+                                period : str="test",
+                                historical : bool=True) -> pd.DataFrame:
+    """Compare stateful simulations of a trained cudalstm model against its windowed predictions (see iter_scenarios()).
+
+    Only days predicted in both modes are compared: windowed predictions are NaN when their window has missing inputs (e.g., the first seq_length - 1 days after a gap), 
+    while stateful simulations only skip the missing days and restart their states after them instead of propagating NaNs through the rest of the record. 
+    The first day predicted in both modes after each gap therefore matches, and differences grow again from there.
+
+    Parameters
+    ----------
+    model_name : str
+        Trained model name. 
+    epoch : int
+        Epoch of the model weights to use.
+    base_experiment_name : str, optional
+        Name of the dataset folder to simulate. By default "historical".
+    period : str, optional
+        Period to compare (i.e., "train", "validation", or "test"). By default "test".
+    historical : bool, optional
+        Flag indicating whether to use folder for historical conditions (True) or future scenarios (False). By default True.
+
+    Returns
+    -------
+    pd.DataFrame
+        Divergence at each gauge and target with columns gauge_id, target, max_abs_diff, mean_abs_diff, relative_diff (i.e., mean_abs_diff / mean absolute windowed prediction), and r.
+    """
+    import numpy as np
+    import pandas as pd
+
+    simulations = {mode: simulate_scenarios(model_name,
+                                            periods = [period],
+                                            epoch = epoch,
+                                            scenarios = {base_experiment_name: None},
+                                            base_experiment_name = base_experiment_name,
+                                            historical = historical,
+                                            stateful = stateful)
+                   for mode, stateful in [("windowed", False), ("stateful", True)]}
+
+    simulations = simulations["windowed"].merge(simulations["stateful"], on=["gauge_id", "date"], suffixes=("_windowed", "_stateful"))
+    targets = [column[:-len("_sim_windowed")] for column in simulations.columns if column.endswith("_sim_windowed")]
+
+    divergence = []
+    for gauge_id, df in simulations.groupby("gauge_id", sort=False):
+        for target in targets:
+            windowed = df[f"{target}_sim_windowed"].to_numpy()
+            stateful = df[f"{target}_sim_stateful"].to_numpy()
+            valid = ~np.isnan(windowed) & ~np.isnan(stateful)
+            windowed = windowed[valid]; stateful = stateful[valid]
+            diff = np.abs(stateful - windowed)
+            divergence.append({"gauge_id": gauge_id,
+                               "target": target,
+                               "max_abs_diff": diff.max(),
+                               "mean_abs_diff": diff.mean(),
+                               "relative_diff": diff.mean() / np.abs(windowed).mean(),
+                               "r": np.corrcoef(windowed, stateful)[0, 1]})
+    divergence = pd.DataFrame(divergence)
+
+    print(f"    Stateful vs. windowed {period} simulations: median relative difference {divergence['relative_diff'].median():.2%}, maximum absolute difference {divergence['max_abs_diff'].max():.4g}")
+
+    return divergence
+
+
+def write_evaluation_store(timeseries : pd.DataFrame,
+                           store_path : Path) -> Path:
+    """Append simulated timeseries (e.g., one gauge at a time from iter_scenarios()) to a typed, partitioned Parquet store.
+
+    The store is partitioned by experiment and gauge, with one file per period (e.g., experiment=historical/gauge_id=07144100/test-0.parquet), 
+    so reads of single experiments or gauges only open their own files (see read_evaluation_store()). Writing a gauge and period that is already stored for an experiment replaces it; 
+    anything else is appended. Dates are stored as dates and timeseries values as float32.
+
+    Parameters
+    ----------
+    timeseries : pd.DataFrame
+        Timeseries with columns gauge_id, date, period, experiment, and {target}_obs and {target}_sim for each target.
+    store_path : Path
+        Folder of the store (e.g., Path("models", "DL", "outputs", "DL_evaluation")).
+
+    Returns
+    -------
+    Path
+        Folder of the store.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    store_path = Path(store_path)
+    schema = pa.schema([("gauge_id", pa.string()), ("date", pa.date32()), ("period", pa.string()), ("experiment", pa.string())] + 
+                       [(column, pa.float32()) for column in timeseries.columns if column.endswith(("_obs", "_sim"))])
+
+    for period, table in timeseries.groupby("period", sort=False):
+        ds.write_dataset(pa.Table.from_pandas(table[schema.names], schema=schema, preserve_index=False),
+                         store_path,
+                         format = "parquet",
+                         partitioning = ds.partitioning(pa.schema([("experiment", pa.string()), ("gauge_id", pa.string())]), flavor="hive"),
+                         basename_template = f"{period}-{{i}}.parquet",
+                         existing_data_behavior = "overwrite_or_ignore",
+                         file_options = ds.ParquetFileFormat().make_write_options(compression="zstd"))
+
+    return store_path
+
+
+def read_evaluation_store(store_path : Path,
+                          experiments : List[str] = None,
+                          gauge_ids : List[str] = None,
+                          periods : List[str] = None,
+                          columns : List[str] = None,
+                          lazy : bool = False) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """Read simulated timeseries from a Parquet store written by write_evaluation_store() (e.g., the test period of gauge X in experiments Y and Z).
+
+    Filters are pushed down to the store, so partitions of other experiments and gauges are never opened.
+
+    Parameters
+    ----------
+    store_path : Path
+        Folder of the store.
+    experiments : List[str], optional
+        Experiments to read. By default None (i.e., all experiments).
+    gauge_ids : List[str], optional
+        Gauges to read. By default None (i.e., all gauges).
+    periods : List[str], optional
+        Periods to read. By default None (i.e., all periods).
+    columns : List[str], optional
+        Columns to read. By default None (i.e., all columns).
+    lazy : bool, optional
+        Flag indicating whether to return an iterator that reads one experiment, gauge and period at a time instead of reading everything at once. By default False.
+
+    Returns
+    -------
+    Union[pd.DataFrame, Iterator[pd.DataFrame]]
+        Timeseries matching every filter, or an iterator over them if lazy.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # partition columns are read as strings, since inferred types would drop the leading zeros of gauge ids
+    partitioning = ds.partitioning(pa.schema([("experiment", pa.string()), ("gauge_id", pa.string())]), flavor="hive")
+    dataset = ds.dataset(Path(store_path), format="parquet", partitioning=partitioning)
+
+    filters = []
+    if experiments is not None:
+        filters.append(ds.field("experiment").isin([str(experiment) for experiment in np.atleast_1d(experiments)]))
+    if gauge_ids is not None:
+        filters.append(ds.field("gauge_id").isin([str(gauge_id) for gauge_id in np.atleast_1d(gauge_ids)]))
+    if periods is not None:
+        filters.append(ds.field("period").isin([str(period) for period in np.atleast_1d(periods)]))
+
+    expression = None
+    for condition in filters:
+        expression = condition if expression is None else expression & condition
+
+    if lazy:
+        tables = (fragment.to_table(schema=dataset.schema, columns=columns, filter=expression) for fragment in dataset.get_fragments(filter=expression))
+        return (table.to_pandas(date_as_object=False) for table in tables if table.num_rows > 0)
+
+    return dataset.to_table(columns=columns, filter=expression).to_pandas(date_as_object=False)
+
+
+def compute_water_use_sensitivity(model_name : str,
+                                  epoch : int,
+                                  variables : List[str] = ["combined_water_use"],
+                                  period : str = "test",
+                                  base_experiment_name : str = "historical",
+                                  historical : bool = True,
+                                  target : str = None,
+                                  batch_size : int = None):
+    """Compute the gradient sensitivity of a trained neuralhydrology model's simulated target (e.g., baseflow) to water use inputs with automatic differentiation.
+
+    Every prediction only depends on its own input window, so the gradient of the summed predictions of a batch gives each prediction's gradient with respect to its own window. 
+    One forward and one backward pass per batch (with windows of all gauges batched together) therefore give d(target)/d(water use) at every lag of every gauge and day, 
+    instead of one full evaluation per water-use fraction as in 10_SensitivityAnalysis.py. 
+    The fraction sensitivity, i.e., the sum over lags of the gradient times water use, is the derivative of the target with respect to a constant water-use change factor, 
+    so it is the local slope of the change-factor experiments at a factor of 1.0.
+
+    Parameters
+    ----------
+    model_name : str
+        Trained model name. 
+    epoch : int
+        Epoch of the model weights to use.
+    variables : List[str], optional
+        Water use inputs to differentiate with respect to (e.g., ["outside_irrigation", "modflow_irrigation"] for a model trained on the split water use variables). By default ["combined_water_use"].
+    period : str, optional
+        Period to compute the sensitivity in (i.e., "train", "validation", or "test"). By default "test".
+    base_experiment_name : str, optional
+        Name of the dataset folder to use. By default "historical".
+    historical : bool, optional
+        Flag indicating whether to use folder for historical conditions (True) or future scenarios (False). By default True.
+    target : str, optional
+        Target variable to differentiate. By default None (i.e., the first target variable of the model config).
+    batch_size : int, optional
+        Number of input windows in each forward and backward pass. By default None (i.e., the batch_size of the model config).
+
+    Returns
+    -------
+    xr.Dataset
+        Sensitivities in physical units with gauge_id, date, and lag (days before the predicted day, 0 being the predicted day) dimensions: {target}_sensitivity_{variable} 
+        (gauge_id, date, lag) and {target}_fraction_sensitivity_{variable} (gauge_id, date).
+    """
+    import numpy as np
+    import torch
+    import xarray as xr
+    from torch.utils.data import ConcatDataset, DataLoader
+    from neuralhydrology.datasetzoo import get_dataset
+    from neuralhydrology.datautils.utils import load_basin_file
+    from neuralhydrology.utils.errors import NoEvaluationDataError
+
+    cfg, model, scaler, id_to_int, additional_features = _load_trained_model(model_name, epoch, base_experiment_name, historical)
+    device = torch.device(cfg.device)
+
+    dynamic_inputs = cfg.mass_inputs + cfg.dynamic_inputs
+    missing = [variable for variable in variables if variable not in dynamic_inputs]
+    if missing:
+        raise ValueError(f"{missing} are not dynamic inputs of {model_name}: {dynamic_inputs}.")
+    columns = [dynamic_inputs.index(variable) for variable in variables]
+
+    target = target or cfg.target_variables[0]
+    target_index = cfg.target_variables.index(target)
+
+    # gradients of normalized variables to physical units
+    input_scale = np.array([float(scaler["xarray_feature_scale"][variable]) for variable in variables])
+    input_center = np.array([float(scaler["xarray_feature_center"][variable]) for variable in variables])
+    target_scale = float(scaler["xarray_feature_scale"][target])
+
+    datasets = {}
+    for gauge_id in load_basin_file(getattr(cfg, f"{period}_basin_file")):
+        try:
+            datasets[gauge_id] = get_dataset(cfg=cfg,
+                                             is_train=False,
+                                             period=period,
+                                             basin=gauge_id,
+                                             additional_features=additional_features,
+                                             id_to_int=id_to_int,
+                                             scaler=scaler)
+        except NoEvaluationDataError:
+            continue
+    gauge_ids = list(datasets.keys())
+    sample_gauges = np.repeat(np.arange(len(gauge_ids)), [len(ds) for ds in datasets.values()])
+
+    # windows of all gauges batched together, in order
+    loader = DataLoader(ConcatDataset(list(datasets.values())), batch_size=batch_size or cfg.batch_size, shuffle=False, num_workers=0, 
+                        collate_fn=datasets[gauge_ids[0]].collate_fn)
+
+    print(f"Computing sensitivity of {target} to {variables} at {len(gauge_ids)} gauges in the {period} period")
+
+    gradients, fraction_gradients, dates = [], [], []
+    for data in loader:
+        dates.append(data["date"][:, -1])
+        data = _to_device(data, device)
+        if isinstance(data["x_d"], dict):
+            # neuralhydrology >= 1.12: one [batch_size, seq_length, 1] tensor per feature
+            x_d = [data["x_d"][variable].requires_grad_(True) for variable in variables]
+            y_hat = model(model.pre_model_hook(data, is_train=False))["y_hat"][:, -1, target_index]
+            gradient = torch.cat(torch.autograd.grad(y_hat.sum(), x_d), dim=-1)
+            water_use = torch.cat(x_d, dim=-1).detach()
+        else:
+            x_d = data["x_d"].requires_grad_(True)
+            y_hat = model(model.pre_model_hook(data, is_train=False))["y_hat"][:, -1, target_index]
+            gradient, = torch.autograd.grad(y_hat.sum(), x_d)
+            gradient = gradient[:, :, columns]
+            water_use = x_d[:, :, columns].detach()
+
+        # [batch_size, lag, variables], lag 0 being the predicted day
+        gradient = gradient.flip(1).cpu().numpy() * target_scale / input_scale
+        water_use = water_use.flip(1).cpu().numpy() * input_scale + input_center
+        gradients.append(gradient.astype(np.float32))
+        fraction_gradients.append((gradient * water_use).sum(axis=1).astype(np.float32))
+
+    gradients = np.concatenate(gradients)
+    fraction_gradients = np.concatenate(fraction_gradients)
+    dates = np.concatenate(dates)
+
+    # arrange samples by gauge and date
+    date_index = np.unique(dates)
+    d = np.searchsorted(date_index, dates)
+    sensitivity = np.full((len(gauge_ids), len(date_index)) + gradients.shape[1:], np.nan, dtype=np.float32)
+    fraction_sensitivity = np.full((len(gauge_ids), len(date_index), len(variables)), np.nan, dtype=np.float32)
+    sensitivity[sample_gauges, d] = gradients
+    fraction_sensitivity[sample_gauges, d] = fraction_gradients
+
+    data_vars = {}
+    for i, variable in enumerate(variables):
+        data_vars[f"{target}_sensitivity_{variable}"] = (("gauge_id", "date", "lag"), sensitivity[..., i])
+        data_vars[f"{target}_fraction_sensitivity_{variable}"] = (("gauge_id", "date"), fraction_sensitivity[..., i])
+
+    return xr.Dataset(data_vars, coords={"gauge_id": gauge_ids, "date": date_index, "lag": np.arange(sensitivity.shape[2])})
+
+
+def _load_trained_model(model_name : str,
+                        epoch : int,
+                        base_experiment_name : str,
+                        historical : bool=True) -> Tuple:
+    """Load a trained model's config (pointed at the base experiment in memory), weights, scalers, basin id encoding, and additional features on cpu; helper for iter_scenarios() and compute_water_use_sensitivity()."""
+    from pathlib import Path
+    import pickle
+    import torch
+    from neuralhydrology.datautils.utils import load_scaler
+    from neuralhydrology.evaluation.utils import load_basin_id_encoding
+    from neuralhydrology.modelzoo import get_model
+    from neuralhydrology.utils.config import Config
+
+    if historical:
+        base_folder = "historical_conditions"
+    else:
+        pass
+        # placeholder to add support for future climate/management scenarios
+
+    # model run directory and data dir on main computer
+    run_dir = Path("models", "DL") / model_name
+    data_dir = Path.cwd() / "models" / "DL" / base_folder / base_experiment_name
+
+    # point config to the base experiment in memory
+    cfg = Config(run_dir / "config.yml")
+    cfg.update_config({"device": "cpu",
+                       "data_dir": str(data_dir),
+                       "train_basin_file": str(data_dir / "gauges.txt"),
+                       "validation_basin_file": str(data_dir / "gauges.txt"),
+                       "test_basin_file": str(data_dir / "gauges.txt")})
+
+    model = get_model(cfg).to(torch.device(cfg.device))
+    model.load_state_dict(torch.load(run_dir / f"model_epoch{str(epoch).zfill(3)}.pt", map_location=torch.device(cfg.device)))
+    model.eval()
+
+    scaler = load_scaler(run_dir)
+    if "xarray_means" in scaler.keys():
+        scaler["xarray_feature_center"] = scaler.pop("xarray_means")
+    if "xarray_stds" in scaler.keys():
+        scaler["xarray_feature_scale"] = scaler.pop("xarray_stds")
+
+    id_to_int = load_basin_id_encoding(run_dir) if cfg.use_basin_id_encoding else {}
+    additional_features = []
+    for file in cfg.additional_feature_files:
+        with open(file, "rb") as fp:
+            additional_features.append(pickle.load(fp))
+
+    return cfg, model, scaler, id_to_int, additional_features
+
+
+def _get_normalized_perturbations(cfg,
+                                  scaler : Dict,
+                                  scenarios : Dict[str, Dict]) -> List[List[Tuple]]:
+    """Convert each scenario's variable perturbations to (variable, column, factor, offset, start date, end date) of the normalized dynamic inputs; helper for iter_scenarios()."""
+    import pandas as pd
+
+    dynamic_inputs = cfg.mass_inputs + cfg.dynamic_inputs
+
+    perturbations = []
+    for experiment, variable_perturbations in scenarios.items():
+        scenario = []
+        for variable, values in (variable_perturbations or {}).items():
+            if variable in dynamic_inputs:
+                factor = float(values[0])
+                center = float(scaler["xarray_feature_center"][variable])
+                scale = float(scaler["xarray_feature_scale"][variable])
+                # (factor * x - center) / scale == factor * x_norm + (factor - 1) * center / scale
+                scenario.append((variable, dynamic_inputs.index(variable), factor, (factor - 1) * center / scale, 
+                                 pd.to_datetime(values[1]).to_datetime64(), pd.to_datetime(values[2]).to_datetime64()))
+            else:
+                print(f"    Warning: '{variable}' not found in the dynamic inputs of '{experiment}'.")
+        perturbations.append(scenario)
+
+    return perturbations
+
+
+def _stack_scenarios(data : Dict,
+                     perturbations : List[List[Tuple]],
+                     device) -> Dict:
+    """Stack one copy of a batch per scenario along the batch dimension, perturbing the normalized dynamic inputs of each copy; helper for iter_scenarios()."""
+    import torch
+
+    stacked = {}
+    for key, value in data.items():
+        if key.startswith("date"):
+            stacked[key] = value
+        elif key == "x_d":
+            x_d = []
+            for scenario in perturbations:
+                x = _clone_inputs(value)
+                for variable, column, factor, offset, start_date, end_date in scenario:
+                    mask = torch.from_numpy((data["date"] >= start_date) & (data["date"] <= end_date))
+                    if isinstance(x, dict):
+                        # neuralhydrology >= 1.12: one [batch_size, seq_length, 1] tensor per feature
+                        x[variable] = torch.where(mask[..., None], factor * x[variable] + offset, x[variable])
+                    else:
+                        x[..., column] = torch.where(mask, factor * x[..., column] + offset, x[..., column])
+                x_d.append(x)
+            stacked[key] = _cat_inputs(x_d, device)
+        else:
+            stacked[key] = _cat_inputs([value] * len(perturbations), device)
+
+    return stacked
+
+
+def _clone_inputs(value):
+    """Clone a batch entry, which is a tensor or (for dynamic inputs in neuralhydrology >= 1.12) a dictionary of tensors by feature; helper for _stack_scenarios()."""
+    if isinstance(value, dict):
+        return {feature: tensor.clone() for feature, tensor in value.items()}
+    return value.clone()
+
+
+def _cat_inputs(values : List, device):
+    """Concatenate tensors, or dictionaries of tensors by feature, along the batch dimension on device; helper for _stack_scenarios()."""
+    import torch
+
+    if isinstance(values[0], dict):
+        return {feature: torch.cat([value[feature] for value in values], dim=0).to(device) for feature in values[0]}
+    return torch.cat(values, dim=0).to(device)
+
+
+def _to_device(data : Dict, device) -> Dict:
+    """Move a batch to device, including dictionaries of tensors by feature (i.e., dynamic inputs in neuralhydrology >= 1.12); helper for compute_water_use_sensitivity()."""
+    moved = {}
+    for key, value in data.items():
+        if key.startswith("date"):
+            moved[key] = value
+        elif isinstance(value, dict):
+            moved[key] = {feature: tensor.to(device) for feature, tensor in value.items()}
+        else:
+            moved[key] = value.to(device)
+
+    return moved
+
+
+def _get_record(ds) -> Tuple[Dict, List[int]]:
+    """Get a gauge's whole normalized record as a batch of one sample and the indices of the days that are predicted; helper for iter_scenarios()."""
+    basin, _ = ds.lookup_table[0]
+    freq = ds.frequencies[0]
+
+    # static inputs from the first sample, dynamic inputs for the whole record
+    data = ds.collate_fn([ds[0]])
+    x_d = ds._x_d[basin][freq]
+    if isinstance(x_d, dict):
+        # neuralhydrology >= 1.12 stores dynamic inputs as one tensor per feature
+        data["x_d"] = {feature: tensor.unsqueeze(0) for feature, tensor in x_d.items()}
+    else:
+        data["x_d"] = x_d.unsqueeze(0)
+    data["y"] = ds._y[basin][freq].unsqueeze(0)
+    data["date"] = ds._dates[basin][freq][None]
+
+    indices = [sample_indices[0] for _, sample_indices in ds.lookup_table.values()]
+
+    return data, indices
+
+
+def _run_stateful(model,
+                  data : Dict,
+                  seq_length : int):
+    """Run a cudalstm model through whole records in chunks of seq_length days, carrying the hidden and cell states from one chunk to the next and restarting them after days with missing inputs; helper for iter_scenarios()."""
+    import numpy as np
+    import torch
+
+    # [seq_length, batch_size, n_features], as in CudaLSTM.forward(); the input layer takes x_d as a tensor or (neuralhydrology >= 1.12) a dictionary of tensors by feature
+    x_d = model.embedding_net(data)
+
+    # runs of days with valid inputs, so NaN inputs don't propagate through the states into the rest of the record
+    valid = (~torch.isnan(x_d).any(dim=2).any(dim=1)).cpu().numpy()
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], valid.astype(int), [0]])))
+
+    # days with missing inputs are NaN
+    y_hat = torch.full((x_d.shape[1], len(x_d), model.output_size), float("nan"), device=x_d.device)
+    for run_start, run_end in zip(edges[::2], edges[1::2]):
+        states = None
+        for start in range(run_start, run_end, seq_length):
+            end = min(start + seq_length, run_end)
+            lstm_output, states = model.lstm(input=x_d[start:end], hx=states)
+            y_hat[:, start:end] = model.head(model.dropout(lstm_output.transpose(0, 1)))["y_hat"]
 
+    return y_hat
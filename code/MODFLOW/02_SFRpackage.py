@@ -6,18 +6,17 @@ import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point, LineString
 
-import flopy
-
-from modflowutils import snap_points_to_sfr_network, evaluate_streamflow_depletion
+from modflowutils import load_model, intersect_points, build_sfr_topology, snap_points_to_sfr_network, evaluate_streamflow_depletion, get_time_axis, resample_time_axis, write_results_store
 
 model_dir = Path("models", "MODFLOW")
 model_path = model_dir / "GMD2_transient"
 modflow_path = model_path / "mf2005.exe"
 
-model = flopy.modflow.Modflow.load("trans_2d.nam",
-                                   model_ws = model_path, 
-                                   exe_name = modflow_path,
-                                   version = "mf2005")
+model = load_model("trans_2d.nam",
+                   model_ws = model_path, 
+                   load_only = ["DIS", "BAS6", "SFR"],
+                   exe_name = modflow_path,
+                   version = "mf2005")
 
 
 # 1. Snap stream gauges (benchmarking locations) with real-world coordinates onto SFR network in the GMD2 model.
@@ -49,24 +48,17 @@ gauges["geometry"] = gauges["geometry"].to_crs(domain_crs).translate(xoff = -dom
                                                                      yoff = -domain_coords[1])
 
 # Snap benchmarking locations onto the model.modelgrid and then to SFR network
-coordinates = []
-
-for idx, gauge_id in gauges.iterrows():
-    x = gauge_id["geometry"].x 
-    y = gauge_id["geometry"].y
-    i, j = model.modelgrid.intersect(x=x, y=y)
-    
-    coordinates.append((i, j))
-    gauges.at[idx, "i"] = i
-    gauges.at[idx, "j"] = j
+gauges["i"], gauges["j"] = intersect_points(model.modelgrid, 
+                                            x = gauges["geometry"].x.to_numpy(), 
+                                            y = gauges["geometry"].y.to_numpy())
 
-gauges["i"] = gauges["i"].astype(int) 
-gauges["j"] = gauges["j"].astype(int)
+sfr_topology = build_sfr_topology(model.sfr.reach_data, model.sfr.segment_data[0])
 
 gauges = snap_points_to_sfr_network(gauges,
                                     pd.DataFrame(model.sfr.reach_data),
                                     id = "gauge_id",
-                                    search_distance = [-1, 0, 1]
+                                    search_distance = [-1, 0, 1],
+                                    sfr_topology = sfr_topology
                                    )
 
 gauges["x"] = gauges["geometry"].x
@@ -91,7 +83,18 @@ if save_path.exists():
 else:
     save_path.mkdir(parents=True)
     
-stream_depletion.to_csv(save_path / "MODFLOW_stream_depletion.csv", index=False)
+write_results_store(stream_depletion, save_path / "MODFLOW_stream_depletion", scenario = "historical", partition_cols = ["gauge_id"]) # read with read_results_store()
+
+# Daily streamflow depletion (i.e., same time axis as the DL models' outputs)
+time_axis = get_time_axis(model.dis, start_datetime = "1935-01-01") # start of the GMD2 transient simulation (the DIS file has no start datetime)
+
+stream_depletion_daily = resample_time_axis(stream_depletion,
+                                            time_axis,
+                                            values = ["Qriver_historical", "Qriver_baseline", "stream_depletion"],
+                                            by = ["gauge_id", "i", "j", "segment", "reach"],
+                                            freq = "D")
+
+stream_depletion_daily.to_csv(save_path / "MODFLOW_stream_depletion_daily.csv", index=False)
 
 
 
@@ -1,21 +1,24 @@
 # 03. Wel package
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from scipy.sparse import save_npz
 
 import geopandas as gpd
 from shapely.geometry import Point
 
-import flopy
+from modflowutils import load_model, get_pumping_matrix, get_watershed_membership, get_time_axis, get_last_kstpkper, resample_time_axis, write_results_store
 
 model_dir = Path("models", "MODFLOW")
 model_path = model_dir / "GMD2_transient"
 modflow_path = model_path / "mf2005.exe"
 
-model = flopy.modflow.Modflow.load("trans_2d.nam",
-                                   model_ws = model_path, 
-                                   exe_name = modflow_path,
-                                   version = "mf2005")
+model = load_model("trans_2d.nam",
+                   model_ws = model_path, 
+                   load_only = ["DIS", "BAS6", "WEL"],
+                   exe_name = modflow_path,
+                   version = "mf2005")
 
 # Get wel flux timeseries (Qw [ft3/d]) for wells in each watershed.
 # Translate real-world coordinates to northing/easting.
@@ -41,64 +44,57 @@ gauge_ids = gauges["gauge_id"]
 
 gauges["geometry"] = gauges["geometry"].to_crs(domain_crs).translate(xoff = -domain_coords[0], 
                                                                      yoff = -domain_coords[1])
-# Get wel fluxes (Qw [ft3/d]) for each stress period.
+# Get wel fluxes (Qw [ft3/d]) for each stress period as a matrix of wells x stress periods.
 nper = model.dis.nper
-kstpkper = [(0, 0)] + [(9, ts) for ts in range(1, nper)] # reproduce FloPy's .get_kstpkper() method; returns a List[(timesteps, stress periods)]
+time_axis = get_time_axis(model.dis, start_datetime = "1935-01-01") # start of the GMD2 transient simulation (the DIS file has no start datetime)
+last_ts = get_last_kstpkper(time_axis)["ts"].to_numpy() # last time step of each stress period (i.e., FloPy's .get_kstpkper() of saved outputs)
 
-wel_package = model.wel.stress_period_data
+wels, Qwel = get_pumping_matrix(model, sparse = True)
 
-wels_all = []
-
-for i in kstpkper:
-    ts, sp = i
-    wel_sp = pd.DataFrame(wel_package[sp])
-    wel_sp["kstpkper"] = [i] * len(wel_sp) ; wel_sp["sp"] = sp ; wel_sp["ts"] = ts
-    wel_sp.rename(columns={"flux" : "Qwel"}, inplace = True)
-    wels_all.append(wel_sp[["i", "j", "kstpkper", "ts", "sp", "Qwel"]])
-    
-wels_all = pd.concat(wels_all, ignore_index=True)
-
-wels_all
+wels
 
 # Translate wel i and j coordinates to set the origin in the lower-left corner.
 save_path = model_dir / "outputs"
+save_path.mkdir(parents=True, exist_ok=True)
 
 nrows = model.nrow
 ncols = model.ncol
 
-wels_all["x"] = (wels_all["j"] + 0.5) 
-wels_all["y"] = (nrows - wels_all["i"] + 0.5) 
-
-wels_all.to_csv(save_path / "MODFLOW_Qwel_all.csv", index=False)
-
+wels["x"] = (wels["j"] + 0.5) 
+wels["y"] = (nrows - wels["i"] + 0.5) 
 
-# Get wels in each watershed
-wels_all = gpd.GeoDataFrame(
-    wels_all,
-    geometry = [Point(xy) for xy in zip(wels_all["x"]*400, wels_all["y"]*400)], 
-    crs = domain_crs
-)
+wels.to_csv(save_path / "MODFLOW_wels.csv", index_label="well")
+save_npz(save_path / "MODFLOW_Qwel_matrix.npz", Qwel)
 
-num_wels = {}
-watershed_wels = []
+# Long table of wel fluxes for each stress period
+Qwel_coo = Qwel.tocoo()
+order = np.lexsort((Qwel_coo.coords[0], Qwel_coo.coords[1]))
+well = Qwel_coo.coords[0][order]; sp = Qwel_coo.coords[1][order]
+ts = last_ts[sp]
 
-for gauge_id in gauge_ids:
+wels_all = pd.DataFrame({"i": wels["i"].to_numpy()[well],
+                         "j": wels["j"].to_numpy()[well],
+                         "kstpkper": list(zip(ts.tolist(), sp.tolist())),
+                         "ts": ts,
+                         "sp": sp,
+                         "Qwel": Qwel_coo.data[order],
+                         "x": wels["x"].to_numpy()[well],
+                         "y": wels["y"].to_numpy()[well]})
 
-    watershed = watersheds[watersheds["gauge_id"] == gauge_id]
-    
-    wels = gpd.sjoin(wels_all, watershed, how="inner", predicate="within").drop(columns=["index_right"])
-    wels["gauge_id"] = gauge_id
+write_results_store(wels_all, save_path / "MODFLOW_Qwel_all", scenario = "historical", partition_cols = []) # read with read_results_store()
 
-    num_wels[gauge_id] = wels.groupby(["i", "j"]).ngroup().nunique()
-    
-    watershed_wels.append(wels)
 
-watershed_wels = pd.concat(watershed_wels, ignore_index=True)
+# Get wels in each watershed
+membership = get_watershed_membership(wels["x"]*400, 
+                                      wels["y"]*400, 
+                                      watersheds, 
+                                      ids = gauge_ids, 
+                                      id = "gauge_id")
 
-watershed_wels = watershed_wels[["gauge_id", "i", "j", "kstpkper", "ts", "sp", "Qwel", "x", "y", "geometry"]]
+num_wels = dict(zip(gauge_ids, membership.sum(axis=1).astype(int)))
 
-num_total_wels = wels_all.groupby(["i", "j"]).ngroup().nunique()
-num_total_wels_across_watersheds = watershed_wels.groupby(["i", "j"]).ngroup().nunique()
+num_total_wels = wels.groupby(["i", "j"]).ngroup().nunique()
+num_total_wels_across_watersheds = wels[membership.sum(axis=0) > 0].groupby(["i", "j"]).ngroup().nunique()
 percentage = num_total_wels_across_watersheds / num_total_wels
 
 print("Total number of pumping wells in GMD2 model:", num_total_wels)
@@ -106,12 +102,48 @@ print(f"Total number of wells across watersheds:, {num_total_wels_across_watersh
 print("Number of pumping wells per watershed:")
 num_wels
 
-watershed_wels.drop("geometry", axis=1, inplace=True)
+# Long table of wel fluxes for each stress period of wels in each watershed
+watershed_index, well_index = membership.tocoo().coords
+counts = np.diff(Qwel.indptr)[well_index]
+entries = np.repeat(Qwel.indptr[well_index], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+gauge = np.repeat(watershed_index, counts); well = np.repeat(well_index, counts); sp = Qwel.indices[entries]
+order = np.lexsort((well, sp, gauge))
+gauge = gauge[order]; well = well[order]; sp = sp[order]; entries = entries[order]
+ts = last_ts[sp]
 
-watershed_wels.to_csv(save_path / "MODFLOW_Qwel_watersheds.csv", index=False)
+watershed_wels = pd.DataFrame({"gauge_id": np.asarray(gauge_ids)[gauge],
+                               "i": wels["i"].to_numpy()[well],
+                               "j": wels["j"].to_numpy()[well],
+                               "kstpkper": list(zip(ts.tolist(), sp.tolist())),
+                               "ts": ts,
+                               "sp": sp,
+                               "Qwel": Qwel.data[entries],
+                               "x": wels["x"].to_numpy()[well],
+                               "y": wels["y"].to_numpy()[well]})
+
+write_results_store(watershed_wels, save_path / "MODFLOW_Qwel_watersheds", scenario = "historical", partition_cols = ["gauge_id"])
 
 watershed_wels
 
+# Total wel fluxes (Qw [ft3/d]) in each watershed for each stress period
+Qwel_watersheds = membership @ Qwel
+
+Qwel_watersheds = pd.DataFrame({"gauge_id": np.repeat(np.asarray(gauge_ids), nper),
+                                "sp": np.tile(np.arange(nper), len(gauge_ids)),
+                                "Qwel": Qwel_watersheds.toarray().ravel()})
+
+Qwel_watersheds.to_csv(save_path / "MODFLOW_Qwel_watersheds_total.csv", index=False)
+
+Qwel_watersheds
+
+# Daily and water-year total wel fluxes in each watershed (i.e., same time axes as the DL models' inputs and outputs)
+Qwel_watersheds_daily = resample_time_axis(Qwel_watersheds, time_axis, values = ["Qwel"], by = ["gauge_id"], freq = "D")
+Qwel_watersheds_wy = resample_time_axis(Qwel_watersheds, time_axis, values = ["Qwel"], by = ["gauge_id"], freq = "Y-SEP", how = "sum") # Qw [ft3] pumped in each water year
+
+Qwel_watersheds_daily.to_csv(save_path / "MODFLOW_Qwel_watersheds_daily.csv", index=False)
+Qwel_watersheds_wy.to_csv(save_path / "MODFLOW_Qwel_watersheds_wateryear.csv", index=False)
+
 
 
 
@@ -0,0 +1,75 @@
+# 04. Stream-depletion response functions
+from pathlib import Path
+
+import pandas as pd
+
+from modflowutils import load_model, get_wells, write_perturbation_workspaces, run_scenarios, compute_response_functions, save_response_functions, load_response_functions, get_cluster_schedule, predict_streamflow_depletion, validate_response_functions
+
+model_dir = Path("models", "MODFLOW")
+model_path = model_dir / "GMD2_transient"
+modflow_path = model_path / "mf2005.exe"
+
+model = load_model("trans_2d.nam",
+                   model_ws = model_path, 
+                   exe_name = modflow_path,
+                   version = "mf2005")
+
+gauges = pd.read_csv(Path("data", "gauges_i+jcoordinates.csv"), dtype={"gauge_id":str})
+
+nper = model.dis.nper
+
+
+# 1. Run one perturbation simulation per cluster of wells (i.e., unit pumping during a single stress period)
+start_sp = 1
+unit_flux = -1000.0 # Qw [ft³/d]
+
+wells = get_wells(model, block_size = 10)
+print(f"{len(wells)} wells grouped into {wells['cluster'].nunique()} clusters.")
+
+perturbation_paths = write_perturbation_workspaces(model,
+                                                   wells,
+                                                   model_dir = model_dir / "perturbations",
+                                                   start_sp = start_sp,
+                                                   unit_flux = unit_flux,
+                                                   baseline_path = model_dir / "GMD2_transient_baseline") # perturbations start at start_sp from the baseline heads
+
+summary = run_scenarios({f"perturbation_{cluster}": path for cluster, path in perturbation_paths.items()},
+                        exe_name = modflow_path,
+                        namefile = "trans_2d.nam",
+                        timeout = 24 * 60 * 60)
+if not summary["success"].all():
+    raise Exception("MODFLOW did not terminate successfully.")
+
+
+# 2. Compute and save unit response functions of streamflow depletion at each gauge
+response_functions = compute_response_functions(gauges,
+                                                 wells,
+                                                 perturbation_paths,
+                                                 baseline_path = model_dir / "GMD2_transient_baseline",
+                                                 nper = nper,
+                                                 start_sp = start_sp,
+                                                 unit_flux = unit_flux,
+                                                 id = "gauge_id")
+
+save_path = model_dir / "outputs"
+save_path.mkdir(parents=True, exist_ok=True)
+
+save_response_functions(response_functions, save_path / "MODFLOW_response_functions.npz")
+
+
+# 3. Validate response functions against streamflow depletion from the historical and baseline simulations
+response_functions = load_response_functions(save_path / "MODFLOW_response_functions.npz")
+
+validation = validate_response_functions(response_functions,
+                                         model,
+                                         historical_path = model_dir / "GMD2_transient",
+                                         baseline_path = model_dir / "GMD2_transient_baseline",
+                                         id = "gauge_id")
+
+
+# 4. Predict streamflow depletion for a pumping scenario (e.g., pumping reduced by 50%)
+schedule = get_cluster_schedule(model.wel.stress_period_data, response_functions, nper)
+
+stream_depletion = predict_streamflow_depletion(response_functions, 0.5 * schedule, id = "gauge_id")
+
+stream_depletion
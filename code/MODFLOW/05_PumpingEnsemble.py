@@ -0,0 +1,55 @@
+# 05. Run GMD2 MODFLOW model with pumping scaled by a range of fractions (i.e., MODFLOW counterpart of 10_SensitivityAnalysis.py)
+from pathlib import Path
+
+import pandas as pd
+
+from modflowutils import load_model, run_pumping_ensemble, evaluate_streamflow_depletion, write_results_store
+
+model_dir = Path("models", "MODFLOW")
+model_path = model_dir / "GMD2_transient"
+modflow_path = model_path / "mf2005.exe"
+
+model = load_model("trans_2d.nam",
+                   model_ws = model_path,
+                   exe_name = modflow_path,
+                   version = "mf2005")
+
+gauges = pd.read_csv(Path("data", "gauges_i+jcoordinates.csv"), dtype={"gauge_id":str})
+
+save_path = model_dir / "outputs"
+save_path.mkdir(parents=True, exist_ok=True)
+
+results_file = save_path / "MODFLOW_stream_depletion_ensemble.csv"
+results_file.unlink(missing_ok=True)
+
+
+# Perturb pumping by [0, 1.0, 0.1]; 0.0 and 1.0 are the baseline and historical simulations from 01_RunMODFLOW.py
+pumping_fracs = [round(num * 0.10, 2) for num in range(1, 10)]
+
+summary = run_pumping_ensemble(model,
+                               gauges,
+                               factors = pumping_fracs,
+                               model_dir = model_dir / "ensemble",
+                               baseline_path = model_dir / "GMD2_transient_baseline",
+                               results_file = results_file,
+                               exe_name = modflow_path,
+                               namefile = "trans_2d.nam",
+                               timeout = 24 * 60 * 60,
+                               id = "gauge_id",
+                               historical_path = model_path) # scenarios start at the first stress period with pumping from the historical heads
+if not summary["success"].all():
+    raise Exception("MODFLOW did not terminate successfully.")
+
+stream_depletion = evaluate_streamflow_depletion(gauges,
+                                                 historical_path = model_dir / "GMD2_transient",
+                                                 baseline_path = model_dir / "GMD2_transient_baseline",
+                                                 id = "gauge_id")
+stream_depletion["factor"] = 1.0
+stream_depletion.to_csv(results_file, mode="a", header=False, index=False)
+
+stream_depletion = pd.read_csv(results_file, dtype={"gauge_id":str})
+
+for factor, scenario in stream_depletion.groupby("factor"):
+    write_results_store(scenario.drop("factor", axis=1), save_path / "MODFLOW_stream_depletion", scenario = f"pumping_{factor}", partition_cols = ["gauge_id"])
+
+stream_depletion.groupby(["factor", "gauge_id"])["stream_depletion"].mean()
@@ -1,66 +1,537 @@
 from pathlib import Path
-from typing import List
+from typing import List, Tuple, Dict
 
+import numpy as np
 import pandas as pd
 
+def intersect_points(modelgrid,
+                     x : np.ndarray,
+                     y : np.ndarray,
+                     forgive : bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """Get i and j coordinates of the cells that contain points, for many points at once.
+
+    Unlike FloPy's model.modelgrid.intersect(), which handles one point at a time, cell edges are found from the cumulative sums of delr and delc and all points are located with np.searchsorted().
+    Cells are half-open, so a point on the edge between two cells always belongs to the cell with the larger index (i.e., the cell to the east for a shared column edge and the cell to the south for a shared row edge).
+    Points on the east or south boundary of the grid belong to the last column or row.
+
+    Parameters
+    ----------
+    modelgrid : flopy.discretization.StructuredGrid
+        FloPy's model.modelgrid.
+    x : np.ndarray
+        x coordinates of points, in the same coordinate system as modelgrid (i.e., with its xoff, yoff, and angrot applied).
+    y : np.ndarray
+        y coordinates of points.
+    forgive : bool, optional
+        Flag indicating whether to return -1 for points outside the grid (True) or raise an error (False). By default False.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        i and j coordinates of points.
+    """
+    x, y = modelgrid.get_local_coords(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    x = np.atleast_1d(x); y = np.atleast_1d(y)
+
+    # cell edges from the west and from the north edge of the grid
+    xedges = np.concatenate([[0.0], np.cumsum(modelgrid.delr)])
+    yedges = np.concatenate([[0.0], np.cumsum(modelgrid.delc)])
+    distance_from_top = yedges[-1] - y
+
+    j = np.searchsorted(xedges, x, side="right") - 1
+    i = np.searchsorted(yedges, distance_from_top, side="right") - 1
+
+    # points on the east or south boundary of the grid
+    j[x == xedges[-1]] = len(xedges) - 2
+    i[distance_from_top == yedges[-1]] = len(yedges) - 2
+
+    outside = (j < 0) | (j > len(xedges) - 2) | (i < 0) | (i > len(yedges) - 2) | np.isnan(x) | np.isnan(y)
+    if outside.any():
+        if not forgive:
+            raise ValueError(f"{outside.sum()} points are outside of the model grid.")
+        i[outside] = -1
+        j[outside] = -1
+
+    return i, j
+
+
 def snap_points_to_sfr_network(points : pd.DataFrame,
                                sfr_network : pd.DataFrame,
                                id : str = "gauge_id",
-                               search_distance : List[int]=[-1, 0, 1]) -> pd.DataFrame:
-    """Get i and j coordinates of the intersected, or most upstream, sfr cell for points intersected using FloPy's model.modelgrid.intersect() method.
+                               search_distance : List[int]=[-1, 0, 1],
+                               sfr_topology : Dict = None) -> pd.DataFrame:
+    """Get i and j coordinates of the intersected, or most upstream, sfr cell for points intersected using intersect_points() (or FloPy's model.modelgrid.intersect()).
 
-    Because of how the .intersect() method handles intersections of where a point is on the edge of two cells, it can be the case that the returned points are +/- one cell off from their locations in the model.
+    Points on the edge of two cells are assigned to one of them, so it can be the case that the intersected points are +/- one cell off from their locations in the model.
     In those cases, we perform a one cell search around those points and return the most upstream sfr cell.
 
+    All points and offsets are resolved at once against a (row, col) -> reach lookup built from sfr_network, so snapping thousands of points is fast.
+
     Parameters
     ----------
     points : pd.DataFrame
         Points to be "snapped" onto sfr network; must contain id, "i", and "j" columns.
-    stream_network : pd.DataFrame
-        FloPy's model.sfr.network. 
+    sfr_network : pd.DataFrame
+        FloPy's model.sfr.reach_data. 
     id : str, optional
         id for point's i and j coordinates. By default "gauge_id". 
     search_distance : List[int], optional
         List containing the vector of distances to search neighboring points by. By default [-1, 0, 1]. 
+    sfr_topology : Dict, optional
+        Topology of sfr_network, as returned by build_sfr_topology(). If provided, the most upstream sfr cell is the one farthest from the outlet along the network's routing (ties go to the lowest reachID); otherwise, the one with the lowest reachID. By default None.
         
     Returns
     -------
     pd.DataFrame
         Points "snapped" onto sfr network with updated "i" and "j" columns that corresponding to the intersected, or most upstream, sfr cell within search_distance. 
     """
-    import itertools
-    offsets = list(itertools.product(search_distance, search_distance))
-    
-    neighboring_cells = []
-    for idx, point in points.iterrows():
-        for di, dj in offsets:
-            neighbor = point.copy()
-            neighbor["i"] = point["i"] + di
-            neighbor["j"] = point["j"] + dj
-            neighboring_cells.append(neighbor)
-        
-    neighboring_cells = pd.DataFrame(neighboring_cells)
+    offsets = np.array(np.meshgrid(np.unique(search_distance), np.unique(search_distance), indexing="ij")).reshape(2, -1)
+
+    point_i = points["i"].to_numpy(dtype=np.int64)
+    point_j = points["j"].to_numpy(dtype=np.int64)
+    reach_i = sfr_network["i"].to_numpy(dtype=np.int64)
+    reach_j = sfr_network["j"].to_numpy(dtype=np.int64)
+    reach_id = sfr_network["reachID"].to_numpy()
+
+    # upstream rank of each reach (0 = most upstream); depths tie across tributaries, so ties go to the lowest reachID and each point snaps to a single reach
+    upstream = reach_id if sfr_topology is None else -np.asarray(sfr_topology["depth"])
+    rank = np.empty(len(reach_id), dtype=np.int64)
+    rank[np.lexsort((reach_id, upstream))] = np.arange(len(reach_id))
+
+    # (row, col) -> reach lookup
+    ncol = max(reach_j.max(initial=0), point_j.max(initial=0) + offsets[1].max()) + 1
+    order = np.argsort(reach_i * ncol + reach_j, kind="stable")
+    sorted_keys = (reach_i * ncol + reach_j)[order]
+
+    # neighboring cells of every point, with shape (points, offsets)
+    neighbor_i = point_i[:, None] + offsets[0][None, :]
+    neighbor_j = point_j[:, None] + offsets[1][None, :]
+    neighbor_keys = np.where((neighbor_i >= 0) & (neighbor_j >= 0), neighbor_i * ncol + neighbor_j, -1).ravel()
+
+    # (point, reach) pairs for every sfr cell in a neighboring cell
+    lo = np.searchsorted(sorted_keys, neighbor_keys, side="left")
+    counts = np.searchsorted(sorted_keys, neighbor_keys, side="right") - lo
+    pair_point = np.repeat(np.repeat(np.arange(len(points)), offsets.shape[1]), counts)
+    pair_reach = order[np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+
+    # intersected sfr cells, or else the most upstream sfr cell
+    intersected = (reach_i[pair_reach] == point_i[pair_point]) & (reach_j[pair_reach] == point_j[pair_point])
+    has_intersected = np.bincount(pair_point, weights=intersected, minlength=len(points)) > 0
+
+    min_rank = np.full(len(points), len(reach_id), dtype=np.int64)
+    np.minimum.at(min_rank, pair_point, rank[pair_reach])
+    most_upstream = rank[pair_reach] == min_rank[pair_point]
+
+    selected = np.where(has_intersected[pair_point], intersected, most_upstream)
+    pair_point = pair_point[selected]; pair_reach = pair_reach[selected]
+
+    res = pd.DataFrame({"point": pair_point,
+                        "i": reach_i[pair_reach],
+                        "j": reach_j[pair_reach],
+                        "iseg": sfr_network["iseg"].to_numpy()[pair_reach],
+                        "ireach": sfr_network["ireach"].to_numpy()[pair_reach]})
+
+    return (pd.merge(points.drop(columns=["i", "j"]).reset_index(drop=True).reset_index(names="point"), res, on="point", how="left")
+            .drop(columns=["point"]))
+
+
+def build_sfr_topology(reach_data : pd.DataFrame, segment_data : pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Build the routing topology of an sfr network once, for fast upstream/downstream queries.
+
+    Reaches flow to the next reach in their segment, and the last reach of a segment flows to the first reach of its outseg. 
+    Reaches are stored in depth-first order from the outlets, so the reaches upstream of any reach (including itself) are a contiguous range of that order.
+    Diversions (i.e., iupseg > 0) are treated as headwaters, so flow diverted from a segment is not counted upstream of the diversion.
+
+    Parameters
+    ----------
+    reach_data : pd.DataFrame
+        FloPy's model.sfr.reach_data; must contain "iseg", "ireach", "i", and "j" columns.
+    segment_data : pd.DataFrame
+        FloPy's model.sfr.segment_data[0]; must contain "nseg" and "outseg" columns.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        "iseg", "ireach", "i", and "j" of each reach (in reach_data order), its "downstream" reach (-1 for outlets), its "depth" (number of reaches downstream to the outlet), 
+        the depth-first "order" of reaches from the outlets, and the "start" and "stop" of the range of "order" upstream of each reach.
+    """
+    reach_data = pd.DataFrame(reach_data)
+    segment_data = pd.DataFrame(segment_data)
+
+    iseg = reach_data["iseg"].to_numpy(dtype=np.int64)
+    ireach = reach_data["ireach"].to_numpy(dtype=np.int64)
+    nreach = len(reach_data)
+
+    # next reach in segment
+    srt = np.lexsort((ireach, iseg))
+    downstream = np.full(nreach, -1)
+    same_segment = iseg[srt[1:]] == iseg[srt[:-1]]
+    downstream[srt[:-1][same_segment]] = srt[1:][same_segment]
+
+    # first reach of outseg for the last reach of each segment
+    last = srt[np.append(~same_segment, True)]
+    first = srt[np.insert(~same_segment, 0, True)]
+    first_reach = pd.Series(first, index=iseg[first])
+    outseg = pd.Series(segment_data["outseg"].to_numpy(), index=segment_data["nseg"].to_numpy()).reindex(iseg[last]).fillna(0).to_numpy(dtype=np.int64)
+    downstream[last] = first_reach.reindex(outseg).fillna(-1).to_numpy(dtype=np.int64)
+
+    # upstream reaches of each reach, sorted by downstream reach
+    upstream = np.argsort(downstream, kind="stable")
+    upstream_start = np.searchsorted(downstream[upstream], np.arange(nreach), side="left")
+    upstream_stop = np.searchsorted(downstream[upstream], np.arange(nreach), side="right")
+
+    # depth-first order from the outlets
+    order = np.empty(nreach, dtype=np.int64)
+    depth = np.zeros(nreach, dtype=np.int64)
+    stack = list(np.flatnonzero(downstream == -1)[::-1])
+    n = 0
+    while stack:
+        reach = stack.pop()
+        order[n] = reach; n += 1
+        children = upstream[upstream_start[reach]:upstream_stop[reach]]
+        depth[children] = depth[reach] + 1
+        stack.extend(children[::-1])
+    if n != nreach:
+        raise ValueError(f"{nreach - n} reaches are in a loop and do not drain to an outlet.")
+
+    start = np.empty(nreach, dtype=np.int64)
+    start[order] = np.arange(nreach)
+
+    # number of reaches upstream of each reach, accumulated from the headwaters
+    size = np.ones(nreach, dtype=np.int64)
+    for reach in order[::-1]:
+        if downstream[reach] >= 0:
+            size[downstream[reach]] += size[reach]
+
+    return {"iseg": iseg,
+            "ireach": ireach,
+            "i": reach_data["i"].to_numpy(),
+            "j": reach_data["j"].to_numpy(),
+            "downstream": downstream,
+            "depth": depth,
+            "order": order,
+            "start": start,
+            "stop": start + size}
+
+
+def get_reach_index(sfr_topology : Dict, iseg : np.ndarray, ireach : np.ndarray) -> np.ndarray:
+    """Get the position in reach_data of reaches given by their segment and reach numbers.
+
+    Parameters
+    ----------
+    sfr_topology : Dict
+        Topology of the sfr network, as returned by build_sfr_topology().
+    iseg : np.ndarray
+        Segment numbers (e.g., "iseg" of points snapped with snap_points_to_sfr_network()).
+    ireach : np.ndarray
+        Reach numbers.
+
+    Returns
+    -------
+    np.ndarray
+        Position of each reach in reach_data.
+    """
+    index = pd.Series(np.arange(len(sfr_topology["iseg"])), 
+                      index=pd.MultiIndex.from_arrays([sfr_topology["iseg"], sfr_topology["ireach"]]))
+    reaches = index.reindex(pd.MultiIndex.from_arrays([np.atleast_1d(iseg), np.atleast_1d(ireach)]))
+    if reaches.isna().any():
+        raise ValueError(f"{reaches.isna().sum()} reaches are not in the sfr network.")
+
+    return reaches.to_numpy(dtype=np.int64)
+
+
+def get_upstream_reaches(sfr_topology : Dict, reaches : np.ndarray) -> np.ndarray:
+    """Get all reaches upstream of each reach (including itself), for many reaches at once.
+
+    Parameters
+    ----------
+    sfr_topology : Dict
+        Topology of the sfr network, as returned by build_sfr_topology().
+    reaches : np.ndarray
+        Positions of reaches in reach_data (e.g., as returned by get_reach_index()).
+
+    Returns
+    -------
+    np.ndarray
+        Boolean mask with shape (reaches, reaches in reach_data) that is True for reaches upstream of each reach.
+    """
+    reaches = np.atleast_1d(reaches)
+    start = sfr_topology["start"]
+
+    return (start[None, :] >= start[reaches][:, None]) & (start[None, :] < sfr_topology["stop"][reaches][:, None])
+
+
+def accumulate_along_network(sfr_topology : Dict, values : np.ndarray) -> np.ndarray:
+    """Accumulate values of each reach along the sfr network (e.g., change in Qaquifer into cumulative streamflow depletion).
+
+    Parameters
+    ----------
+    sfr_topology : Dict
+        Topology of the sfr network, as returned by build_sfr_topology().
+    values : np.ndarray
+        Values of each reach, in reach_data order along the last axis (e.g., with shape (time steps, reaches)).
+
+    Returns
+    -------
+    np.ndarray
+        Sum of values over all reaches upstream of each reach (including itself), with the same shape as values.
+    """
+    values = np.asarray(values)
+    cumulative = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(values[..., sfr_topology["order"]], axis=-1)], axis=-1)
+
+    return cumulative[..., sfr_topology["stop"]] - cumulative[..., sfr_topology["start"]]
+
+
+_SFR_INDEXES = {}
+
+
+def index_sfr_file(file : Path) -> Dict:
+    """Build an offset index of a text SFR output file (ISTCB2 > 0) so single reaches and time steps can be read without parsing the whole file.
+
+    The file is memory-mapped and scanned once for newlines and time step headers. 
+    Indexes are cached in memory by path, size, and modification time, so repeated calls on the same file are free.
+
+    Parameters
+    ----------
+    file : Path
+        Path to the SFR output file (e.g., "trans_2d.sfb").
+
+    Returns
+    -------
+    Dict
+        Index with column names, kstpkper of each time step, layer/row/column/segment/reach of each sfr cell, and byte offsets of every data line with shape (time steps, sfr cells).
+    """
+    import mmap
+    import re
+
+    file = Path(file).resolve()
+    stat = file.stat()
+    key = (str(file), stat.st_size, stat.st_mtime_ns)
+    if key in _SFR_INDEXES:
+        return _SFR_INDEXES[key]
+
+    with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # offsets of the start of each line, found in chunks to bound memory
+        chunk_size = 2**26
+        newlines = [np.flatnonzero(np.frombuffer(mm, dtype=np.uint8, count=min(chunk_size, len(mm) - start), offset=start) == 10) + start
+                    for start in range(0, len(mm), chunk_size)]
+        line_starts = np.concatenate([[0]] + [n + 1 for n in newlines])
+        line_ends = np.append(np.concatenate(newlines), len(mm)) if newlines else np.array([len(mm)])
+
+        # time step headers (i.e., same as FloPy's SfrFile.get_times())
+        step_lines = np.unique(np.searchsorted(line_starts, [m.start() for m in re.finditer(rb"STEP", mm)], side="right") - 1)
+        kstpkper = []
+        for line in step_lines:
+            items = mm[line_starts[line]:line_ends[line]].split()
+            kstpkper.append((int(items[5]) - 1, int(items[3]) - 1))
+        kstpkper = np.array(kstpkper, dtype=np.int64).reshape(-1, 2)
+
+        # header lines between the time step header and the first sfr cell, and number of sfr cells, from the first time step
+        first_data_line = None
+        nstrm = 0
+        for line in range(step_lines[0] + 1 if len(step_lines) else len(line_ends), len(line_ends)):
+            items = mm[line_starts[line]:line_ends[line]].split()
+            if len(items) > 0 and items[0].isdigit():
+                if first_data_line is None:
+                    first_data_line = line
+                    ncol = len(items)
+                nstrm += 1
+            elif first_data_line is not None:
+                break
+        if first_data_line is None:
+            raise ValueError(f"could not evaluate format of {str(file)!r} for index_sfr_file")
+        header = mm[:line_starts[first_data_line]].decode(errors="replace")
+
+        data_lines = step_lines[:, None] + (first_data_line - step_lines[0]) + np.arange(nstrm)[None, :]
+        if data_lines[-1, -1] >= len(line_starts) or np.any(data_lines[:-1, -1] >= step_lines[1:]):
+            raise ValueError(f"time steps of {str(file)!r} do not have the same number of sfr cells")
+
+        cells = np.array(b" ".join(mm[line_starts[line]:line_ends[line]] for line in data_lines[0]).split(), dtype=float).reshape(nstrm, ncol)
+
+    # same column names as FloPy's SfrFile
+    names = ["layer", "row", "column", "segment", "reach", "Qin", "Qaquifer", "Qout", "Qovr", "Qprecip", "Qet", "stage", "depth", "width", "Cond"]
+    if "GRADIENT" in header:
+        names.append("gradient")
+    elif "CHNG. UNSAT." in header:
+        names += ["Qwt", "delUzstor"]
+        if ncol == 18:
+            names.append("gw_head")
+    if "ELEVATION" in header:
+        names.append("strtop")
+
+    index = {"file": file,
+             "names": names[:ncol],
+             "ncol": ncol,
+             "kstpkper": kstpkper,
+             "k": cells[:, 0].astype(int) - 1,
+             "i": cells[:, 1].astype(int) - 1,
+             "j": cells[:, 2].astype(int) - 1,
+             "segment": cells[:, 3].astype(int),
+             "reach": cells[:, 4].astype(int),
+             "starts": line_starts[data_lines],
+             "ends": line_ends[data_lines]}
+
+    _SFR_INDEXES[key] = index
+    return index
+
+
+def read_sfr_file(file : Path,
+                  points : pd.DataFrame,
+                  kstpkper : Tuple = None,
+                  columns : List[str] = ["Qout"],
+                  cache : bool = False,
+                  cache_dir : Path = None) -> Dict[str, np.ndarray]:
+    """Read selected sfr cells and time steps of a text SFR output file (ISTCB2 > 0) into NumPy arrays.
+
+    Only the data lines of the requested sfr cells and time steps are read from the memory-mapped file, using the index built by index_sfr_file().
+    If cache is True, they are read from the file's columnar cache instead, which is built by cache_sfr_file() the first time it is needed.
+
+    Parameters
+    ----------
+    file : Path
+        Path to the SFR output file (e.g., "trans_2d.sfb").
+    points : pd.DataFrame
+        Points on sfr network; must contain "i" and "j" columns. All sfr cells (i.e., reaches) in those model cells are read.
+    kstpkper : Tuple, optional
+        First and last (kstp, kper) to read, inclusive. By default None (i.e., all time steps).
+    columns : List[str], optional
+        SFR output columns to read. By default ["Qout"].
+    cache : bool, optional
+        Flag indicating whether to read from the file's columnar cache. By default False.
+    cache_dir : Path, optional
+        Folder with cached SFR output files. By default None (i.e., ".sfr_cache" next to the SFR output file).
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        "point" index, "i", "j", "segment", and "reach" of each matched sfr cell, "kstpkper" of each time step, and one array with shape (time steps, sfr cells) for each column.
+    """
+    import mmap
+
+    if cache:
+        table = np.load(cache_sfr_file(file, cache_dir))
+    else:
+        table = index_sfr_file(file)
+
+    # sfr cells in the points' model cells
+    cells = pd.DataFrame({"i": table["i"], "j": table["j"]}).reset_index(names="cell")
+    cells = pd.merge(points[["i", "j"]].reset_index(drop=True).reset_index(names="point"), cells, on=["i", "j"], how="inner")
+    cell = cells["cell"].to_numpy()
+
+    # time steps within kstpkper, ordered by stress period then time step
+    steps = np.arange(len(table["kstpkper"]))
+    if kstpkper is not None:
+        order = table["kstpkper"][:, 1] * 2**32 + table["kstpkper"][:, 0]
+        first, last = [kper * 2**32 + kstp for kstp, kper in kstpkper]
+        steps = steps[(order >= first) & (order <= last)]
+
+    res = {"point": cells["point"].to_numpy(),
+           "i": table["i"][cell],
+           "j": table["j"][cell],
+           "segment": table["segment"][cell],
+           "reach": table["reach"][cell],
+           "kstpkper": table["kstpkper"][steps]}
+
+    if cache:
+        for column in columns:
+            res[column] = table[column][np.ix_(steps, cell)]
+        table.close()
+        return res
+
+    starts = table["starts"][np.ix_(steps, cell)].ravel()
+    ends = table["ends"][np.ix_(steps, cell)].ravel()
+    with open(table["file"], "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        values = np.array(b" ".join(mm[start:end] for start, end in zip(starts, ends)).split(), dtype=float)
+    values = values.reshape(len(steps), len(cell), table["ncol"])
+
+    for column in columns:
+        res[column] = values[:, :, table["names"].index(column)]
+
+    return res
+
+
+def cache_sfr_file(file : Path, cache_dir : Path = None) -> Path:
+    """Parse a whole text SFR output file (ISTCB2 > 0) once and save it as a columnar .npz file that is reused by later calls.
+
+    Cached files are content-addressed (i.e., named after the SHA-256 hash of the SFR output file). 
+    The size and modification time of the SFR output file are recorded so an unchanged file is not hashed again, and a rewritten file with the same contents reuses its cached file.
+
+    Parameters
+    ----------
+    file : Path
+        Path to the SFR output file (e.g., "trans_2d.sfb").
+    cache_dir : Path, optional
+        Folder with cached SFR output files. By default None (i.e., ".sfr_cache" next to the SFR output file).
+
+    Returns
+    -------
+    Path
+        Path to the cached .npz file with "kstpkper", "k", "i", "j", "segment", and "reach" arrays, and one array with shape (time steps, sfr cells) for each SFR output column.
+    """
+    import mmap
+
+    file = Path(file).resolve()
+    cache_dir = file.parent / ".sfr_cache" if cache_dir is None else Path(cache_dir)
+
+    sha256 = _get_file_hash(file, cache_dir)
+    cache_file = cache_dir / f"{sha256}.npz"
 
-    neighboring_sfr_cells = pd.merge(neighboring_cells, sfr_network, on=["i", "j"], how="inner")
+    if not cache_file.exists():
+        index = index_sfr_file(file)
+        nsteps, nstrm = index["starts"].shape
 
-    res = []
-    for idx, point in points.iterrows():
-        sfr_coords = neighboring_sfr_cells[(neighboring_sfr_cells[id] == point[id]) & neighboring_sfr_cells["i"].isin([point["i"]]) & neighboring_sfr_cells["j"].isin([point["j"]])]
-        if sfr_coords.empty:
-            sfr_coords = neighboring_sfr_cells.loc[neighboring_sfr_cells["reachID"] == neighboring_sfr_cells[neighboring_sfr_cells[id] == point[id]]["reachID"].min()]  
-        res.append(sfr_coords)
+        values = np.empty((nsteps, nstrm, index["ncol"]))
+        with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for step in range(nsteps):
+                values[step] = np.array(mm[index["starts"][step, 0]:index["ends"][step, -1]].split(), dtype=float).reshape(nstrm, index["ncol"])
 
-    res = pd.concat(res, ignore_index=True)
+        table = {name: values[:, :, c] for c, name in enumerate(index["names"]) if name not in ["layer", "row", "column", "segment", "reach"]}
+        table.update({name: index[name] for name in ["kstpkper", "k", "i", "j", "segment", "reach"]})
 
-    return pd.merge(points.drop(columns=["i", "j"]), res[[id, "i", "j", "iseg", "ireach"]], on=[id], how="left")
+        # write to a temporary file first so an interrupted write is never mistaken for a cached file
+        tmp_file = cache_dir / f"{sha256}.tmp.npz"
+        np.savez(tmp_file, **table)
+        tmp_file.replace(cache_file)
+
+    return cache_file
+
+
+def _get_file_hash(file : Path, cache_dir : Path) -> str:
+    """Get the SHA-256 hash of a file, which is only recomputed when the file's size or modification time change; helper for cached files."""
+    import hashlib
+    import json
+
+    file = Path(file).resolve()
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    stat = file.stat()
+    key_file = cache_dir / f"{file.name}.json"
+    key = json.loads(key_file.read_text()) if key_file.exists() else {}
+
+    if key.get("size") == stat.st_size and key.get("mtime_ns") == stat.st_mtime_ns:
+        return key["sha256"]
+
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(2**24), b""):
+            sha256.update(chunk)
+
+    key_file.write_text(json.dumps({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256.hexdigest()}))
+
+    return sha256.hexdigest()
 
 
 def evaluate_streamflow_depletion(points : pd.DataFrame,
                                   historical_path : Path,
                                   baseline_path : Path,
-                                  id : str = "gauge_id") -> pd.DataFrame:
+                                  id : str = "gauge_id",
+                                  cache : bool = True) -> pd.DataFrame:
     """Estimate streamflow depletion caused by groundwater pumping as the difference between a simulation with pumping and a baseline simulation where pumping has been set to 0. 
 
+    Only the sfr cells at points are read from each simulation's SFR output file (see read_sfr_file()).
+    By default, SFR output files are parsed once and cached (see cache_sfr_file()), so later calls for new points are fast.
+
     Parameters
     ----------
     points : pd.DataFrame
@@ -71,55 +542,89 @@ def evaluate_streamflow_depletion(points : pd.DataFrame,
         Path to a baseline simulation with pumping set to 0. 
     id : str, optional
         id for point's i and j coordinates. By default "gauge_id". 
+    cache : bool, optional
+        Flag indicating whether to read SFR output files from their columnar cache. By default True.
 
     Returns
     -------
     pd.DataFrame
         Timeseries of baseflows and estimated streamflow depletion at points on sfr network. 
     """
-    import warnings
-    import flopy.utils.sfroutputfile as sf
+    historical = _get_qriver(points, historical_path, id, cache)
+    baseline = _get_qriver(points, baseline_path, id, cache)
 
-    with warnings.catch_warnings():
-        warnings.simplefilter(action="ignore", category=FutureWarning)
-    
-        historical_package = sf.SfrFile(historical_path  / "trans_2d.sfb")
-        baseline_package = sf.SfrFile(baseline_path / "trans_2d.sfb")
+    historical.rename({"Qriver": "Qriver_historical"}, axis=1, inplace=True)
+    baseline.rename({"Qriver": "Qriver_baseline"}, axis=1, inplace=True)
 
-        historical = historical_package.get_dataframe().loc[:,["kstpkper", "i", "j", "Qin", "Qaquifer", "Qout", "Qovr", "Qprecip", "Qet", "segment", "reach"]]
-        baseline = baseline_package.get_dataframe().loc[:,["kstpkper", "i", "j", "Qin", "Qaquifer", "Qout", "Qovr", "Qprecip", "Qet", "segment", "reach"]]
+    stream_depletion = pd.merge(historical, baseline.drop(["kstpkper"], axis=1), on=[id, "i", "j", "segment", "reach", "ts", "sp"], how="left")
+
+    stream_depletion["stream_depletion"] = stream_depletion["Qriver_historical"] - stream_depletion["Qriver_baseline"]
     
-    historical = historical[historical["i"].isin(points["i"]) & historical["j"].isin(points["j"])]
-    baseline = baseline[baseline["i"].isin(points["i"]) & baseline["j"].isin(points["j"])]
+    return stream_depletion[[id, "i", "j", "segment", "reach", "kstpkper", "ts", "sp", "Qriver_historical", "Qriver_baseline", "stream_depletion"]]
 
-    historical = pd.merge(points[[id, "i", "j"]], historical, on=["i", "j"], how="left")
-    baseline = pd.merge(points[[id, "i", "j"]], baseline, on=["i", "j"], how="left")
 
-    historical["ts"], historical["sp"] = zip(*historical["kstpkper"])
-    baseline["ts"], baseline["sp"] = zip(*baseline["kstpkper"])
-                      
-    historical.rename({"Qout" : "Qriver"}, axis=1, inplace=True)
-    historical.rename({col: col + "_historical" for col in historical.columns if col.startswith("Q")}, 
-                      axis=1, inplace=True)
+def _get_qriver(points : pd.DataFrame,
+                model_path : Path,
+                id : str = "gauge_id",
+                cache : bool = False) -> pd.DataFrame:
+    """Get a timeseries of Qriver [ft³/d] at points on sfr network from a simulation's SFR output file; helper for evaluate_streamflow_depletion()."""
+    sfr = _read_sfr_output(model_path, points, columns=["Qout"], cache=cache)
 
-    baseline.rename({"Qout" : "Qriver"}, axis=1, inplace=True)
-    baseline.rename({col: col + "_baseline" for col in baseline.columns if col.startswith("Q")}, 
-                    axis=1, inplace=True)
+    # rows ordered by point, time step, and then sfr cell
+    ntimes, ncells = sfr["Qout"].shape
+    step = np.repeat(np.arange(ntimes), ncells)
+    cell = np.tile(np.arange(ncells), ntimes)
+    order = np.lexsort((step, sfr["point"][cell]))
+    step = step[order]; cell = cell[order]
 
-    stream_depletion = pd.merge(historical, baseline.drop(["segment", "reach", "ts", "sp"], axis=1), on=[id, "i", "j", "kstpkper"], how="left")
+    ts = sfr["kstpkper"][step, 0]
+    sp = sfr["kstpkper"][step, 1]
 
-    stream_depletion["stream_depletion"] = stream_depletion["Qriver_historical"] - stream_depletion["Qriver_baseline"]
-    
-    return stream_depletion[[id, "i", "j", "segment", "reach", "kstpkper", "ts", "sp", "Qriver_historical", "Qriver_baseline", "stream_depletion"]]
+    return pd.DataFrame({id: points[id].to_numpy()[sfr["point"][cell]],
+                         "i": sfr["i"][cell],
+                         "j": sfr["j"][cell],
+                         "segment": sfr["segment"][cell],
+                         "reach": sfr["reach"][cell],
+                         "kstpkper": list(zip(ts.tolist(), sp.tolist())),
+                         "ts": ts,
+                         "sp": sp,
+                         "Qriver": sfr["Qout"][step, cell]})
+
+
+def _read_sfr_output(model_path : Path,
+                     points : pd.DataFrame,
+                     columns : List[str] = ["Qout"],
+                     cache : bool = False) -> Dict:
+    """Read a simulation's SFR output file at points, stitching warm-started simulations back onto the stress periods they share with their historical simulation; helper for _get_qriver()."""
+    import json
+
+    sfr = read_sfr_file(Path(model_path) / "trans_2d.sfb", points, columns=columns, cache=cache)
+
+    warm_start_file = Path(model_path) / "warm_start.json"
+    if warm_start_file.exists():
+        warm_start = json.loads(warm_start_file.read_text())
+        start_sp = warm_start["start_sp"]
+        prefix = _read_sfr_output(warm_start["historical_path"], points, columns, cache)
+        for key in ["point", "i", "j", "segment", "reach"]:
+            if not np.array_equal(prefix[key], sfr[key]):
+                raise ValueError(f"sfr cells of {model_path} do not match its historical simulation {warm_start['historical_path']}")
+
+        shared = prefix["kstpkper"][:, 1] < start_sp
+        sfr["kstpkper"] = np.concatenate([prefix["kstpkper"][shared], sfr["kstpkper"] + [0, start_sp]])
+        for column in columns:
+            sfr[column] = np.concatenate([prefix[column][shared], sfr[column]])
+
+    return sfr
 
 
 def calculate_ts_length(nstp : int, perlen : int, tsmult : int) -> List:
-    """Calculate the length of time steps [T] in a stress period when tsmult > 1.
+    """Calculate the length of time steps [T] in a stress period.
     
     The length of the first time step is calculated as:
         ts_i = perlen * ((tsmult - 1) / (tsmult**nstp - 1))
     Successive time steps are calculated as:
         ts_i+1 = ts_i * tsmult
+    When tsmult = 1, every time step has a length of perlen / nstp.
 
     Example:
     perlen = 182.5 
@@ -144,21 +649,1383 @@ def calculate_ts_length(nstp : int, perlen : int, tsmult : int) -> List:
     List
         Length of each time step in a stress period.
     """
-    stp_length = []
-    
-    for i in range(nstp):
-        if i == 0:
-            stp = perlen * ((tsmult - 1) / (tsmult**nstp - 1))
-        elif i > 0:
-            stp = stp * tsmult
-        stp_length.append(stp)
+    return _get_ts_lengths(np.array([perlen]), np.array([nstp]), np.array([tsmult])).tolist()
+
+
+def _get_ts_lengths(perlen : np.ndarray, nstp : np.ndarray, tsmult : np.ndarray) -> np.ndarray:
+    """Calculate the length of every time step [T] of every stress period at once; helper for calculate_ts_length() and get_time_axis()."""
+    perlen = np.asarray(perlen, dtype=float); nstp = np.asarray(nstp, dtype=int); tsmult = np.asarray(tsmult, dtype=float)
+
+    # index of each time step within its stress period
+    kstp = np.arange(nstp.sum()) - np.repeat(np.cumsum(nstp) - nstp, nstp)
+
+    geometric = tsmult != 1
+    first = np.divide(perlen * (tsmult - 1), tsmult**nstp - 1, out=perlen / nstp, where=geometric)
+
+    return np.repeat(first, nstp) * np.repeat(tsmult, nstp)**kstp
+
+
+_ITMUNI_SECONDS = {1: 1, 2: 60, 3: 60 * 60, 4: 24 * 60 * 60, 5: 365.25 * 24 * 60 * 60}
+
+
+def get_time_axis(dis, start_datetime : str = None, skip_steady : bool = True) -> pd.DataFrame:
+    """Build the calendar time axis of a MODFLOW simulation, with the start and end datetimes and duration of every time step (i.e., every kstpkper).
+
+    Time step lengths are computed for all stress periods at once from DIS perlen, nstp, and tsmult (see calculate_ts_length()), and accumulated into calendar datetimes from start_datetime.
+    Rows are ordered by stress period and then time step, so the row of (kstp, kper) is at time_axis["first"][kper] + kstp (see join_time_axis()).
+
+    Parameters
+    ----------
+    dis : flopy.modflow.ModflowDis
+        DIS package of a loaded MODFLOW model.
+    start_datetime : str, optional
+        Datetime at the start of the simulation (e.g., "1935-01-01"). By default None (i.e., dis.start_datetime, which must have been set explicitly rather than left at FloPy's default "1-1-1970").
+    skip_steady : bool, optional
+        Flag indicating whether steady-state stress periods take no calendar time (i.e., their perlen only sets the length of the steady-state solution). By default True.
+
+    Returns
+    -------
+    pd.DataFrame
+        Time axis with "ts", "sp", "kstpkper", "start", "end", "duration" [d], and "totim" [T] (i.e., MODFLOW's simulation time at the end of each time step) columns.
+    """
+    perlen = dis.perlen.array; nstp = dis.nstp.array; tsmult = dis.tsmult.array
+    if start_datetime is None:
+        start_datetime = dis.start_datetime
+        # FloPy's default when the DIS file doesn't set a start datetime
+        if pd.Timestamp(start_datetime) == pd.Timestamp("1970-01-01"):
+            raise ValueError("dis has no start datetime, pass the simulation's start_datetime explicitly")
+
+    lengths = _get_ts_lengths(perlen, nstp, tsmult)
+    sp = np.repeat(np.arange(len(nstp)), nstp)
+    ts = np.arange(len(sp)) - np.repeat(np.cumsum(nstp) - nstp, nstp)
+
+    seconds = lengths * _ITMUNI_SECONDS.get(dis.itmuni, _ITMUNI_SECONDS[4])
+    if skip_steady:
+        seconds = np.where(dis.steady.array[sp], 0.0, seconds)
+    # accumulate in float64 and round to whole seconds, so float32 perlen doesn't drift off midnight (e.g., 23:59:59.99999)
+    elapsed = np.round(np.cumsum(seconds.astype(np.float64))).astype("int64")
+    end = pd.Timestamp(start_datetime) + pd.to_timedelta(elapsed, unit="s")
+    start = end - pd.to_timedelta(np.diff(elapsed, prepend=0), unit="s")
+
+    return pd.DataFrame({"ts": ts,
+                         "sp": sp,
+                         "kstpkper": list(zip(ts.tolist(), sp.tolist())),
+                         "start": start,
+                         "end": end,
+                         "duration": seconds / _ITMUNI_SECONDS[4],
+                         "totim": np.cumsum(lengths)})
+
+
+def get_last_kstpkper(time_axis : pd.DataFrame) -> pd.DataFrame:
+    """Get the last time step of each stress period (i.e., the time steps at which stress-period outputs are usually saved).
+
+    Parameters
+    ----------
+    time_axis : pd.DataFrame
+        Time axis of a MODFLOW simulation, as returned by get_time_axis().
+
+    Returns
+    -------
+    pd.DataFrame
+        Rows of time_axis at the last time step of each stress period, indexed by stress period.
+    """
+    return time_axis.drop_duplicates("sp", keep="last").set_index("sp", drop=False)
+
+
+def join_time_axis(table : pd.DataFrame, time_axis : pd.DataFrame) -> pd.DataFrame:
+    """Join the start and end datetimes and duration of each time step to a table of MODFLOW outputs (e.g., from evaluate_streamflow_depletion() or wel fluxes).
+
+    Rows are matched by position on the time axis rather than by a merge, so tables with millions of rows are joined in a single vectorized lookup.
+    Tables with an "sp" column but no "ts" column (e.g., wel fluxes for each stress period) are joined to the whole stress period.
+
+    Parameters
+    ----------
+    table : pd.DataFrame
+        Table with an "sp" column and, optionally, a "ts" column.
+    time_axis : pd.DataFrame
+        Time axis of a MODFLOW simulation, as returned by get_time_axis().
+
+    Returns
+    -------
+    pd.DataFrame
+        Copy of table with "start", "end", and "duration" [d] columns.
+    """
+    first = np.flatnonzero(time_axis["ts"].to_numpy() == 0)
+    last = np.append(first[1:], len(time_axis)) - 1
+    sp = table["sp"].to_numpy()
+    if np.any((sp < 0) | (sp >= len(first))):
+        raise ValueError("table has stress periods outside the time axis")
+
+    if "ts" in table.columns:
+        rows = first[sp] + table["ts"].to_numpy()
+        if np.any(rows > last[sp]):
+            raise ValueError("table has time steps outside the time axis")
+        start = time_axis["start"].to_numpy()[rows]
+        end = time_axis["end"].to_numpy()[rows]
+    else:
+        start = time_axis["start"].to_numpy()[first[sp]]
+        end = time_axis["end"].to_numpy()[last[sp]]
+
+    table = table.copy()
+    table["start"] = start
+    table["end"] = end
+    table["duration"] = (end - start) / np.timedelta64(1, "D")
+
+    return table
+
+
+def resample_time_axis(table : pd.DataFrame,
+                       time_axis : pd.DataFrame,
+                       values : List[str],
+                       by : List[str] = ["gauge_id"],
+                       freq : str = "D",
+                       how : str = "mean") -> pd.DataFrame:
+    """Resample MODFLOW outputs from time steps (or stress periods) onto a regular calendar axis, such as the daily axis of the DL models' outputs or water years.
+
+    Each calendar period is the duration-weighted combination of the time steps that overlap it, computed for every group and value at once as a sparse (calendar periods x time steps) overlap matrix times a (time steps x series) matrix.
+    Calendar periods not covered by any time step in table (e.g., time steps without saved outputs) are dropped.
+
+    Parameters
+    ----------
+    table : pd.DataFrame
+        Table with an "sp" column, optionally a "ts" column (see join_time_axis()), the by columns, and the values columns.
+    time_axis : pd.DataFrame
+        Time axis of a MODFLOW simulation, as returned by get_time_axis().
+    values : List[str]
+        Columns with rates to resample (e.g., ["Qriver_historical", "Qriver_baseline", "stream_depletion"] [ft³/d]).
+    by : List[str], optional
+        Columns identifying each timeseries in table. By default ["gauge_id"].
+    freq : str, optional
+        Pandas period frequency of the calendar axis (e.g., "D" for days, "Y-SEP" for water years). By default "D".
+    how : str, optional
+        "mean" for the duration-weighted mean rate in each calendar period, or "sum" for the rate integrated over the calendar period (e.g., volume [ft³] from a rate [ft³/d]). By default "mean".
+
+    Returns
+    -------
+    pd.DataFrame
+        Resampled timeseries with the by columns, a "date" column (i.e., start of each calendar period), and the values columns.
+    """
+    from scipy.sparse import csr_array
+
+    if how not in ["mean", "sum"]:
+        raise ValueError(f"how must be 'mean' or 'sum', got {how!r}")
+
+    if table.duplicated(by + [column for column in ["ts", "sp"] if column in table.columns]).any():
+        raise ValueError(f"table has more than one row per time step for some {by} groups")
+
+    table = join_time_axis(table, time_axis)
+
+    # unique time steps (or stress periods) in table and the timeseries they belong to
+    steps = table.groupby(["start", "end"], sort=True).ngroup().to_numpy()
+    intervals = table[["start", "end"]].drop_duplicates().sort_values(["start", "end"])
+    step_start = intervals["start"].to_numpy(); step_end = intervals["end"].to_numpy()
+    groups = table.groupby(by, sort=True)
+    series = groups.ngroup().to_numpy()
+    keys = groups.size().index.to_frame(index=False)
+
+    # calendar periods
+    periods = pd.period_range(step_start.min(), step_end.max(), freq=freq)
+    bounds = np.append(periods.start_time.to_numpy(), periods.end_time.to_numpy()[-1:] + np.timedelta64(1, "ns"))
+
+    # overlap [d] of every time step with every calendar period it spans
+    first = np.searchsorted(bounds, step_start, side="right") - 1
+    last = np.searchsorted(bounds, step_end, side="left") - 1
+    counts = np.maximum(last - first + 1, 0)
+    step = np.repeat(np.arange(len(step_start)), counts)
+    period = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    overlap = (np.minimum(step_end[step], bounds[period + 1]) - np.maximum(step_start[step], bounds[period])) / np.timedelta64(1, "D")
+    keep = overlap > 0
+    weights = csr_array((overlap[keep], (period[keep], step[keep])), shape=(len(periods), len(step_start)))
+
+    res = {}
+    for value in values:
+        matrix = np.full((len(step_start), len(keys)), np.nan)
+        matrix[steps, series] = table[value].to_numpy()
+        observed = ~np.isnan(matrix)
+        total = weights @ np.where(observed, matrix, 0.0)
+        covered = weights @ observed.astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            res[value] = np.where(covered > 0, total / covered if how == "mean" else total, np.nan)
+
+    resampled = pd.DataFrame({column: np.tile(keys[column].to_numpy(), len(periods)) for column in by})
+    resampled["date"] = np.repeat(periods.start_time.to_numpy(), len(keys))
+    for value in values:
+        resampled[value] = res[value].ravel()
+
+    resampled = resampled.dropna(subset=values, how="all")
+    return resampled.sort_values(by + ["date"], kind="stable").reset_index(drop=True)
+
+
+def write_results_store(table : pd.DataFrame,
+                        store_path : Path,
+                        scenario : str,
+                        partition_cols : List[str] = ["gauge_id"]) -> Path:
+    """Write a table of MODFLOW outputs (e.g., streamflow depletion or wel fluxes) for one scenario to a typed, partitioned Parquet store.
+
+    The store is partitioned by scenario and then by partition_cols (e.g., scenario=historical/gauge_id=07144100/part-0.parquet), so reads of single scenarios or gauges only open their own files (see read_results_store()).
+    Rows are sorted by stress period and time step within each file, so the row groups' statistics let reads skip stress periods outside a query.
+    Tuple-valued kstpkper columns are dropped in favour of the integer "ts" and "sp" columns. Writing a scenario replaces any data previously stored for it.
+
+    Parameters
+    ----------
+    table : pd.DataFrame
+        MODFLOW outputs for one scenario, with the partition_cols columns.
+    store_path : Path
+        Folder of the store (e.g., Path("models", "MODFLOW", "outputs", "stream_depletion")).
+    scenario : str
+        Scenario name (e.g., "historical" or "pumping_0.5").
+    partition_cols : List[str], optional
+        Columns to partition each scenario by, besides "scenario". By default ["gauge_id"].
 
-    return stp_length
+    Returns
+    -------
+    Path
+        Folder of the store.
+    """
+    import shutil
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    store_path = Path(store_path)
+    table = table.drop(columns=["kstpkper"], errors="ignore")
+    table.insert(0, "scenario", str(scenario))
+
+    partition_cols = ["scenario"] + list(partition_cols)
+    for column in partition_cols:
+        table[column] = table[column].astype(str)
+    for column in ["k", "i", "j", "segment", "reach", "ts", "sp", "well"]:
+        if column in table.columns:
+            table[column] = table[column].astype(np.int32)
+    table = table.sort_values(partition_cols + [column for column in ["sp", "ts"] if column in table.columns], kind="stable")
+
+    shutil.rmtree(store_path / f"scenario={scenario}", ignore_errors=True)
+    ds.write_dataset(pa.Table.from_pandas(table, preserve_index=False),
+                     store_path,
+                     format = "parquet",
+                     partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in partition_cols]), flavor="hive"),
+                     basename_template = "part-{i}.parquet",
+                     existing_data_behavior = "overwrite_or_ignore",
+                     max_rows_per_group = 2**16,
+                     file_options = ds.ParquetFileFormat().make_write_options(compression="zstd"))
+
+    return store_path
+
+
+def read_results_store(store_path : Path,
+                       scenarios : List[str] = None,
+                       ids : List[str] = None,
+                       sp : Tuple[int, int] = None,
+                       columns : List[str] = None,
+                       id : str = "gauge_id") -> pd.DataFrame:
+    """Read MODFLOW outputs from a partitioned Parquet store written by write_results_store() (e.g., streamflow depletion for gauge X, scenario Y, and stress periods A-B).
+
+    Filters are pushed down to the store: partitions of other scenarios and ids are never opened, and row groups outside the stress periods are skipped using their statistics, so no file is parsed in full.
+
+    Parameters
+    ----------
+    store_path : Path
+        Folder of the store.
+    scenarios : List[str], optional
+        Scenarios to read. By default None (i.e., all scenarios).
+    ids : List[str], optional
+        Values of the id column to read (e.g., gauge ids). By default None (i.e., all ids).
+    sp : Tuple[int, int], optional
+        First and last stress periods (zero-based, inclusive) to read. By default None (i.e., all stress periods).
+    columns : List[str], optional
+        Columns to read. By default None (i.e., all columns).
+    id : str, optional
+        Column filtered by ids. By default "gauge_id".
+
+    Returns
+    -------
+    pd.DataFrame
+        MODFLOW outputs matching every filter.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # partition columns are read as strings, since inferred types would drop the leading zeros of gauge ids
+    partition_cols = []
+    folder = Path(store_path)
+    while (subfolders := sorted(path for path in folder.iterdir() if path.is_dir() and "=" in path.name)):
+        partition_cols.append(subfolders[0].name.split("=")[0])
+        folder = subfolders[0]
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in partition_cols]), flavor="hive")
+
+    dataset = ds.dataset(Path(store_path), format="parquet", partitioning=partitioning)
+
+    filters = []
+    if scenarios is not None:
+        filters.append(ds.field("scenario").isin([str(scenario) for scenario in np.atleast_1d(scenarios)]))
+    if ids is not None:
+        filters.append(ds.field(id).isin([str(value) for value in np.atleast_1d(ids)]))
+    if sp is not None:
+        filters.append((ds.field("sp") >= sp[0]) & (ds.field("sp") <= sp[1]))
+
+    expression = None
+    for condition in filters:
+        expression = condition if expression is None else expression & condition
+
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def scale_wel_fluxes(model, factor : float) -> Dict[int, np.ndarray]:
+    """Scale Qw [ft³/d] of every well in the WEL package by a constant factor, in place.
+
+    Only stress periods with their own entry in wel.stress_period_data are scaled, so stress periods that reuse a previous stress period's wells are not scaled twice.
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package.
+    factor : float
+        Change factor applied to fluxes (e.g., 0.0 for a baseline simulation with pumping set to 0).
+
+    Returns
+    -------
+    Dict[int, np.ndarray]
+        Copy of the original fluxes for each scaled stress period, which can be passed to restore_wel_fluxes().
+    """
+    original_fluxes = {}
+    for sp, wel_sp in model.wel.stress_period_data.data.items():
+        if isinstance(wel_sp, np.recarray):
+            original_fluxes[sp] = wel_sp["flux"].copy()
+            wel_sp["flux"] *= factor
+
+    return original_fluxes
+
+
+def restore_wel_fluxes(model, original_fluxes : Dict[int, np.ndarray]):
+    """Restore fluxes in the WEL package that were scaled by scale_wel_fluxes().
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package.
+    original_fluxes : Dict[int, np.ndarray]
+        Original fluxes for each scaled stress period, as returned by scale_wel_fluxes().
+    """
+    for sp, flux in original_fluxes.items():
+        model.wel.stress_period_data.data[sp]["flux"] = flux
+
+
+def write_scenario_workspace(model,
+                             model_ws : Path,
+                             flux_factor : float = 0.0,
+                             stress_period_data : Dict = None,
+                             packages : List[str] = ["WEL"],
+                             link : bool = True) -> Path:
+    """Write the input files of a pumping scenario to its own model workspace.
+
+    By default, only the packages changed by the scenario are written. All other files in the model's workspace are hard-linked (or symlinked, or copied where links are not supported) into the scenario's workspace, 
+    except for the name file, which is rewritten, and MODFLOW output files listed in it (i.e., LIST and DATA files without an OLD status), so creating a scenario is nearly free.
+    The model's workspace and WEL package are restored once the input files are written, so the same loaded model can be used to write several scenarios.
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package, whose workspace holds its input files. With link, OC and every package with output units (e.g., SFR, LPF) must be loaded.
+    model_ws : Path
+        Model workspace for the scenario.
+    flux_factor : float, optional
+        Change factor applied to fluxes for the scenario. By default 0.0 (i.e., a baseline simulation with pumping set to 0).
+    stress_period_data : Dict, optional
+        WEL stress period data for the scenario (i.e., {stress period: recarray}) replacing the model's wells; flux_factor is ignored if provided. By default None.
+    packages : List[str], optional
+        Packages changed by the scenario, which are written to the scenario's workspace. By default ["WEL"].
+    link : bool, optional
+        Flag indicating whether to link unchanged files from the model's workspace (True) or write every package with FloPy's model.write_input() (False). By default True.
+
+    Returns
+    -------
+    Path
+        Model workspace for the scenario.
+    """
+    original_ws = model.model_ws
+    (Path(model_ws) / "warm_start.json").unlink(missing_ok=True)
+
+    if stress_period_data is None:
+        original_fluxes = scale_wel_fluxes(model, flux_factor)
+    else:
+        original_data = dict(model.wel.stress_period_data.data)
+        model.wel.stress_period_data = stress_period_data
+
+    try:
+        if link:
+            written = [model.get_package(package) for package in packages]
+            _link_model_files(model, Path(model_ws), skip=[package.file_name[0] for package in written])
+            model.change_model_ws(new_pth = model_ws)
+            for package in written:
+                # never write through a link to the model's own input file
+                Path(package.fn_path).unlink(missing_ok=True)
+                package.write_file()
+        else:
+            model.change_model_ws(new_pth = model_ws)
+            model.write_input()
+    finally:
+        model.change_model_ws(new_pth = original_ws)
+        if stress_period_data is None:
+            restore_wel_fluxes(model, original_fluxes)
+        else:
+            model.wel.stress_period_data = original_data
+
+    return Path(model_ws)
+
+
+def _link_model_files(model,
+                      model_ws : Path,
+                      skip : List[str] = []):
+    """Link the input files of a model's workspace into another workspace and rewrite its name file; helper for write_scenario_workspace() and write_warm_start_workspace()."""
+    import os
+    import shutil
+    import inspect
+
+    source_ws = Path(model.model_ws); namefile = model.namefile
+    with open(source_ws / namefile, "r") as f:
+        lines = f.readlines()
+
+    # output units are only known for loaded packages, so every package that can write outputs (OC and packages with cell-by-cell or SFR output units) must be loaded
+    output_ftypes = {"oc", "gage", "hyd", "mnwi"} | {ftype for ftype, package_class in model.mfnam_packages.items()
+                                                      if {"ipakcb", "istcb1", "istcb2"} & set(inspect.signature(package_class.__init__).parameters)}
+    ftypes = [line.split()[0].lower() for line in lines if line.strip() and not line.lstrip().startswith("#")]
+    loaded = [package.upper() for package in model.get_package_list()]
+    missing = [ftype.upper() for ftype in ftypes if ftype in output_ftypes and ftype.upper() not in loaded]
+    if missing:
+        raise ValueError(f"Packages {missing} can write outputs but are not loaded, so their output files cannot be told apart from input files; load them (e.g., load_model(load_only=None)).")
+
+    # MODFLOW output files are never linked, since MODFLOW would write through the link into the model's own outputs:
+    # the LIST file, the model's output files (e.g., heads and budget from OC), and the cell-by-cell and SFR output units of its packages
+    output_units = {unit for package in model.packagelist
+                    for unit in [getattr(package, attr, 0) for attr in ["ipakcb", "istcb1", "istcb2", "iuhead", "iuddn", "iubud", "iuibnd"]]
+                    if isinstance(unit, (int, np.integer)) and unit > 0}
+    outputs = set(skip) | set(model.output_fnames)
+    for line in lines:
+        entry = line.split()
+        if len(entry) < 3 or entry[0].startswith("#"):
+            continue
+        if entry[0].upper() == "LIST" or (entry[1].lstrip("-").isdigit() and abs(int(entry[1])) in output_units):
+            outputs.add(entry[2])
+
+    model_ws.mkdir(parents=True, exist_ok=True)
+    skip_files = {(source_ws / file).resolve() for file in outputs | {namefile}}
+
+    for root, dirs, files in os.walk(source_ws):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and (Path(root) / d).resolve() != model_ws.resolve()]
+        for file in files:
+            src = Path(root) / file
+            if src.resolve() in skip_files or src.suffix == ".stdout":
+                continue
+            dst = model_ws / src.relative_to(source_ws)
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            dst.unlink(missing_ok=True)
+            try:
+                os.link(src, dst)
+            except OSError:
+                try:
+                    os.symlink(src.resolve(), dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+
+    # rewritten name file
+    (model_ws / namefile).unlink(missing_ok=True)
+    with open(model_ws / namefile, "w") as f:
+        f.writelines(lines)
+
+
+def get_divergence_sp(model, flux_factor : float = 0.0, stress_period_data : Dict = None) -> int:
+    """Get the first stress period in which a pumping scenario's wells differ from the model's wells (i.e., where the scenario diverges from the historical simulation).
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package.
+    flux_factor : float, optional
+        Change factor applied to fluxes for the scenario. By default 0.0 (i.e., a baseline simulation with pumping set to 0).
+    stress_period_data : Dict, optional
+        WEL stress period data for the scenario (i.e., {stress period: recarray}); flux_factor is ignored if provided. By default None.
+
+    Returns
+    -------
+    int
+        First stress period (zero-based) that differs from the model; nper if the scenario never diverges.
+    """
+    from flopy.utils import MfList
+
+    wel = model.wel.stress_period_data
+    if stress_period_data is not None:
+        scenario = MfList(model.wel, dtype=wel.dtype, data=stress_period_data)
+
+    for sp in range(model.nper):
+        wel_sp = _get_period_records(wel, sp)
+        if stress_period_data is None:
+            if flux_factor != 1.0 and np.any(wel_sp["flux"] != 0):
+                return sp
+        elif not np.array_equal(wel_sp, _get_period_records(scenario, sp)):
+            return sp
+
+    return model.nper
+
+
+def _get_period_records(mflist, sp : int) -> np.recarray:
+    """Get the records of a stress period from a flopy MfList, with an empty recarray for stress periods without any (e.g., ITMP=0, which flopy stores as int 0); helper for get_divergence_sp() and write_warm_start_workspace()."""
+    records = mflist[sp]
+    return records if isinstance(records, np.recarray) else mflist.get_empty(0)
+
+
+def write_warm_start_workspace(model,
+                               model_ws : Path,
+                               historical_path : Path,
+                               start_sp : int,
+                               flux_factor : float = 0.0,
+                               stress_period_data : Dict = None,
+                               head_file : str = "trans_2d.hds") -> Path:
+    """Write the input files of a pumping scenario that starts at stress period start_sp from the heads of a historical simulation.
+
+    Stress periods before start_sp are shared with the historical simulation, so they are dropped from the scenario:
+    DIS keeps stress periods start_sp onwards, every stress-period package (e.g., WEL, RCH, SFR, and OC) is shifted back by start_sp,
+    and BAS6 strt is set to the heads saved by the historical simulation at the last time step of stress period start_sp - 1, so the compute time of late-start scenarios drops roughly in proportion.
+    MODFLOW-2005 SFR has no initial condition input; without transient routing (IRTFLG = 0) or unsaturated flow beneath streams (ISFROPT > 1), stream flows and stages are recomputed from heads at every time step, so heads are the only state carried over.
+    A warm_start.json file in the scenario's workspace records the historical simulation and start_sp, so SFR outputs are stitched back onto the shared stress periods (see evaluate_streamflow_depletion()).
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package, whose workspace holds its input files; the model is not modified. OC and every package with output units (e.g., SFR, LPF) must be loaded.
+    model_ws : Path
+        Model workspace for the scenario.
+    historical_path : Path
+        Path to a simulation that shares the scenario's stress periods before start_sp and saved heads at the last time step of stress period start_sp - 1.
+    start_sp : int
+        First stress period (zero-based) simulated by the scenario (e.g., get_divergence_sp()).
+    flux_factor : float, optional
+        Change factor applied to fluxes for the scenario. By default 0.0 (i.e., a baseline simulation with pumping set to 0).
+    stress_period_data : Dict, optional
+        WEL stress period data for the scenario (i.e., {stress period: recarray}) for every stress period of the model; flux_factor is ignored if provided. By default None.
+    head_file : str, optional
+        Binary head file of the historical simulation. By default "trans_2d.hds".
+
+    Returns
+    -------
+    Path
+        Model workspace for the scenario.
+    """
+    import copy
+    import json
+    import warnings
+    import flopy
+    from flopy.utils import MfList, Transient2d
+
+    nper = model.nper
+    if not 0 < start_sp < nper:
+        raise ValueError(f"start_sp must be between 1 and {nper - 1}, got {start_sp}")
+
+    nstp = model.dis.nstp.array
+    heads = flopy.utils.HeadFile(Path(historical_path) / head_file)
+    kstpkper = (int(nstp[start_sp - 1]) - 1, start_sp - 1)
+    if kstpkper not in heads.get_kstpkper():
+        raise ValueError(f"{Path(historical_path) / head_file} has no heads saved at time step {kstpkper[0] + 1} of stress period {kstpkper[1] + 1}")
+    strt = heads.get_data(kstpkper=kstpkper)
+
+    scenario = copy.deepcopy(model)
+    if stress_period_data is None:
+        scale_wel_fluxes(scenario, flux_factor)
+    else:
+        scenario.wel.stress_period_data = stress_period_data
+
+    def shift(data, resolved):
+        shifted = {0: resolved}
+        shifted.update({sp - start_sp: value for sp, value in data.items() if sp > start_sp})
+        return shifted
+
+    changed = []
+    for package in scenario.packagelist:
+        name = package.name[0].upper()
+        if name == "SFR":
+            if package.irtflg > 0 or package.isfropt > 1:
+                warnings.warn("SFR routing or unsaturated flow state is not carried over to warm-started scenarios")
+            last = max(sp for sp in package.segment_data if sp <= start_sp)
+            dataset_5 = package.dataset_5
+            channel_geometry_data = package.channel_geometry_data
+            channel_flow_data = package.channel_flow_data
+            package.segment_data = shift(package.segment_data, package.segment_data[last])
+            package.dataset_5 = shift(dataset_5, [len(package.segment_data[0])] + list(dataset_5[start_sp][1:]))
+            for attr, data in [("channel_geometry_data", channel_geometry_data), ("channel_flow_data", channel_flow_data)]:
+                previous = [sp for sp in data if sp <= start_sp]
+                setattr(package, attr, shift(data, data[max(previous)]) if previous else {sp - start_sp: value for sp, value in data.items() if sp > start_sp})
+            changed.append(package)
+        elif name == "OC":
+            package.stress_period_data = {(kper - start_sp, kstp): value for (kper, kstp), value in package.stress_period_data.items() if kper >= start_sp}
+            changed.append(package)
+        elif name not in ["DIS", "BAS6"]:
+            for attr, value in list(vars(package).items()):
+                if isinstance(value, MfList):
+                    setattr(package, attr, shift(value.data, _get_period_records(value, start_sp).copy()))
+                elif isinstance(value, Transient2d):
+                    setattr(package, attr, shift({sp: value.transient_2ds[sp].array for sp in value.transient_2ds}, value[start_sp].array))
+                else:
+                    continue
+                if package not in changed:
+                    changed.append(package)
+
+    dis = scenario.dis
+    flopy.modflow.ModflowDis(scenario,
+                             nlay = dis.nlay,
+                             nrow = dis.nrow,
+                             ncol = dis.ncol,
+                             nper = nper - start_sp,
+                             delr = dis.delr.array,
+                             delc = dis.delc.array,
+                             laycbd = dis.laycbd.array,
+                             top = dis.top.array,
+                             botm = dis.botm.array,
+                             perlen = dis.perlen.array[start_sp:],
+                             nstp = nstp[start_sp:],
+                             tsmult = dis.tsmult.array[start_sp:],
+                             steady = dis.steady.array[start_sp:],
+                             itmuni = dis.itmuni,
+                             lenuni = dis.lenuni,
+                             unitnumber = dis.unit_number[0],
+                             filenames = dis.file_name[0])
+    scenario.bas6.strt = strt
+    changed += [scenario.dis, scenario.bas6]
+
+    _link_model_files(model, Path(model_ws), skip=[package.file_name[0] for package in changed])
+    scenario.change_model_ws(new_pth = model_ws)
+    for package in changed:
+        # never write through a link to the model's own input file
+        Path(package.fn_path).unlink(missing_ok=True)
+        package.write_file()
+
+    (Path(model_ws) / "warm_start.json").write_text(json.dumps({"historical_path": str(Path(historical_path).resolve()), "start_sp": start_sp}))
+
+    return Path(model_ws)
+
+
+def get_listing_file(model_ws : Path, namefile : str = "trans_2d.nam") -> Path:
+    """Get the path to the listing file (i.e., LIST entry) of a MODFLOW name file.
+
+    Parameters
+    ----------
+    model_ws : Path
+        Model workspace.
+    namefile : str, optional
+        MODFLOW name file. By default "trans_2d.nam".
+
+    Returns
+    -------
+    Path
+        Path to the listing file.
+    """
+    with open(Path(model_ws) / namefile, "r") as f:
+        for line in f:
+            entry = line.split()
+            if entry and entry[0].upper() == "LIST":
+                return Path(model_ws) / entry[2]
+
+    raise ValueError(f"No LIST entry found in {Path(model_ws) / namefile}")
+
+
+def _run_modflow(scenario : str,
+                 model_ws : Path,
+                 exe_name : Path,
+                 namefile : str,
+                 timeout : float) -> Dict:
+    """Run a single MODFLOW simulation in its model workspace; helper for run_scenarios()."""
+    import subprocess
+    import time
+
+    start = time.perf_counter()
+    stdout_file = Path(model_ws) / f"{Path(namefile).stem}.stdout"
+
+    try:
+        with open(stdout_file, "w") as f:
+            proc = subprocess.run([str(exe_name), namefile], cwd=model_ws, stdout=f, stderr=subprocess.STDOUT, timeout=timeout)
+        returncode = proc.returncode
+        message = ""
+    except subprocess.TimeoutExpired:
+        returncode = None
+        message = f"Timed out after {timeout} s."
+    except OSError as e:
+        # e.g., missing model workspace or executable
+        returncode = None
+        message = f"MODFLOW could not be run: {e}"
+
+    # MODFLOW-2005 reports normal termination on the console, not in the listing file (as in FloPy's run_model(normal_msg=...))
+    normal_termination = False
+    if returncode is not None and stdout_file.exists():
+        with open(stdout_file, "r", errors="replace") as f:
+            normal_termination = returncode == 0 and any("normal termination" in line.lower() for line in f)
+
+    if returncode is not None and not normal_termination and not message:
+        message = f"MODFLOW did not terminate successfully (return code {returncode})."
+
+    # the listing file is only recorded, so a missing or unreadable name file doesn't fail a run that terminated normally
+    try:
+        listing_file = get_listing_file(model_ws, namefile)
+    except (ValueError, OSError):
+        listing_file = None
+
+    return {"scenario": scenario,
+            "model_ws": Path(model_ws),
+            "success": normal_termination,
+            "returncode": returncode,
+            "runtime": time.perf_counter() - start,
+            "listing_file": listing_file,
+            "stdout_file": stdout_file,
+            "message": message}
+
+
+def run_scenarios(scenarios : Dict[str, Path],
+                  exe_name : Path,
+                  namefile : str = "trans_2d.nam",
+                  max_workers : int = None,
+                  timeout : float = None) -> pd.DataFrame:
+    """Run MODFLOW simulations of several scenarios concurrently, each in its own model workspace.
+
+    Each simulation is an independent MODFLOW process, so the wall-clock time of running all scenarios is about that of the slowest one when there are enough cores.
+    A simulation is successful if MODFLOW returns 0 and reports "normal termination" on the console, whose output is saved next to the listing file.
+
+    Parameters
+    ----------
+    scenarios : Dict[str, Path]
+        Scenario names and their model workspaces with input files already written (e.g., with write_scenario_workspace()).
+    exe_name : Path
+        Path to the MODFLOW executable.
+    namefile : str, optional
+        MODFLOW name file in each model workspace. By default "trans_2d.nam".
+    max_workers : int, optional
+        Maximum number of simulations to run at once. By default None (i.e., one per scenario, up to the number of cores).
+    timeout : float, optional
+        Time [s] after which a simulation is stopped and reported as failed. By default None (i.e., no timeout).
+
+    Returns
+    -------
+    pd.DataFrame
+        Summary of each simulation; "success" column is True for simulations that terminated normally, and "message" says why the others failed 
+        (e.g., a missing model workspace), so one failed scenario does not stop the others.
+    """
+    import os
+    from concurrent.futures import ThreadPoolExecutor
+
+    summary_columns = ["scenario", "model_ws", "success", "returncode", "runtime", "listing_file", "stdout_file", "message"]
+    if not scenarios:
+        print("No MODFLOW simulations to run.")
+        return pd.DataFrame(columns=summary_columns)
+
+    exe_name = Path(exe_name).resolve()
+    if max_workers is None:
+        max_workers = min(len(scenarios), os.cpu_count() or 1)
+
+    # MODFLOW runs in its own process, so threads are enough to run simulations in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_run_modflow, scenario, model_ws, exe_name, namefile, timeout) for scenario, model_ws in scenarios.items()]
+        summary = pd.DataFrame([future.result() for future in futures])
+
+    print(f"{summary['success'].sum()}/{len(summary)} MODFLOW simulations terminated successfully.")
+    for _, run in summary.iterrows():
+        status = "passed" if run["success"] else "failed"
+        print(f"    {run['scenario']}: {status} in {run['runtime']:.1f} s. {run['message']}".rstrip())
+
+    return summary
+
+
+def run_pumping_ensemble(model,
+                         points : pd.DataFrame,
+                         factors : List[float],
+                         model_dir : Path,
+                         baseline_path : Path,
+                         results_file : Path,
+                         exe_name : Path,
+                         namefile : str = "trans_2d.nam",
+                         max_workers : int = None,
+                         timeout : float = None,
+                         id : str = "gauge_id",
+                         keep_outputs : bool = False,
+                         historical_path : Path = None) -> pd.DataFrame:
+    """Run MODFLOW simulations with fluxes scaled by each factor across a pool of workers and collect streamflow depletion at points as each simulation finishes.
+
+    At most max_workers scenario workspaces exist at once: each one is written just before its simulation starts (see write_scenario_workspace()), 
+    and once it finishes, its streamflow depletion relative to the baseline simulation is appended to results_file and its workspace is deleted, so disk use stays bounded.
+    If historical_path is provided, each scenario starts at its first perturbed stress period from the historical simulation's heads (see write_warm_start_workspace()).
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package, whose workspace holds its input files.
+    points : pd.DataFrame
+        Points to estimate streamflow depletion on sfr network; must contain id, "i", and "j" columns.
+    factors : List[float]
+        Change factors applied to fluxes (e.g., [0.1, 0.2, ..., 0.9]).
+    model_dir : Path
+        Folder where scenario model workspaces are written to.
+    baseline_path : Path
+        Path to a baseline simulation with pumping set to 0.
+    results_file : Path
+        CSV file that streamflow depletion of each scenario is appended to, with a "factor" column.
+    exe_name : Path
+        Path to the MODFLOW executable.
+    namefile : str, optional
+        MODFLOW name file. By default "trans_2d.nam".
+    max_workers : int, optional
+        Maximum number of simulations to run at once. By default None (i.e., the number of cores).
+    timeout : float, optional
+        Time [s] after which a simulation is stopped and reported as failed. By default None (i.e., no timeout).
+    id : str, optional
+        id for point's i and j coordinates. By default "gauge_id". 
+    keep_outputs : bool, optional
+        Flag indicating whether to keep scenario workspaces once their streamflow depletion is collected. By default False (i.e., only workspaces of failed simulations are kept).
+    historical_path : Path, optional
+        Path to the historical simulation of the model, with heads saved at the end of every stress period, to warm-start scenarios from. By default None (i.e., every stress period is simulated).
+
+    Returns
+    -------
+    pd.DataFrame
+        Summary of each simulation, as in run_scenarios(), with a "factor" column.
+    """
+    import os
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    exe_name = Path(exe_name).resolve()
+    results_file = Path(results_file)
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    factors = iter(factors)
+    pending = {}
+    summary = []
+
+    # MODFLOW runs in its own process, so threads are enough to run simulations in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # workspaces are written from this thread only, since writing a scenario temporarily changes the model
+            for factor in factors:
+                start_sp = get_divergence_sp(model, flux_factor=factor) if historical_path is not None else 0
+                if 0 < start_sp < model.nper:
+                    model_ws = write_warm_start_workspace(model, Path(model_dir) / f"ensemble_{factor}", historical_path, start_sp, flux_factor=factor)
+                else:
+                    model_ws = write_scenario_workspace(model, Path(model_dir) / f"ensemble_{factor}", flux_factor=factor)
+                pending[executor.submit(_run_modflow, f"ensemble_{factor}", model_ws, exe_name, namefile, timeout)] = (factor, model_ws)
+                if len(pending) >= max_workers:
+                    break
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                factor, model_ws = pending.pop(future)
+                run = future.result()
+                run["factor"] = factor
+
+                if run["success"]:
+                    stream_depletion = evaluate_streamflow_depletion(points, model_ws, baseline_path, id, cache=False)
+                    stream_depletion["factor"] = factor
+                    stream_depletion.to_csv(results_file, mode="a", header=not results_file.exists(), index=False)
+
+                if run["success"] and not keep_outputs:
+                    for key in [key for key in _SFR_INDEXES if Path(key[0]).is_relative_to(Path(model_ws).resolve())]:
+                        del _SFR_INDEXES[key]
+                    shutil.rmtree(model_ws)
+
+                status = "passed" if run["success"] else "failed"
+                print(f"    ensemble_{factor}: {status} in {run['runtime']:.1f} s. {run['message']}".rstrip())
+                summary.append(run)
+
+    summary = pd.DataFrame(summary)
+    print(f"{summary['success'].sum()}/{len(summary)} MODFLOW simulations terminated successfully.")
+
+    return summary
+
+
+def get_wells(model, block_size : int = 1) -> pd.DataFrame:
+    """Get the unique wells in the WEL package and group them into clusters of neighboring cells.
+
+    Wells are clustered on blocks of block_size x block_size cells, which keeps the number of perturbation runs needed by write_perturbation_workspaces() manageable.
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package.
+    block_size : int, optional
+        Size of the blocks [cells] that wells are clustered on. By default 1 (i.e., one cluster per cell).
+
+    Returns
+    -------
+    pd.DataFrame
+        Unique wells with their "k", "i", "j", and "cluster" columns. 
+    """
+    wells = [pd.DataFrame(wel_sp) for wel_sp in model.wel.stress_period_data.data.values() if isinstance(wel_sp, np.recarray)]
+    wells = (pd.concat(wells, ignore_index=True)
+             .drop_duplicates(subset=["k", "i", "j"])
+             .sort_values(["k", "i", "j"])
+             .reset_index(drop=True))
+
+    blocks = wells["i"].to_numpy() // block_size * (model.ncol // block_size + 1) + wells["j"].to_numpy() // block_size
+    wells["cluster"] = np.unique(blocks, return_inverse=True)[1]
+
+    return wells
+
+
+def write_perturbation_workspaces(model,
+                                  wells : pd.DataFrame,
+                                  model_dir : Path,
+                                  start_sp : int = 1,
+                                  unit_flux : float = -1000.0,
+                                  baseline_path : Path = None) -> Dict[int, Path]:
+    """Write one perturbation simulation per cluster of wells for estimating unit response functions.
+
+    Each perturbation simulation has pumping set to 0 except for the wells in one cluster, which pump a total of unit_flux [ft³/d] (split evenly among wells) during stress period start_sp only.
+    If baseline_path is provided, perturbation simulations start at stress period start_sp from the baseline simulation's heads (see write_warm_start_workspace()).
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package.
+    wells : pd.DataFrame
+        Unique wells and their clusters, as returned by get_wells().
+    model_dir : Path
+        Folder where perturbation model workspaces are written to.
+    start_sp : int, optional
+        Stress period when pumping starts. By default 1 (i.e., the first transient stress period of the GMD2 model).
+    unit_flux : float, optional
+        Total flux [ft³/d] of the wells in a cluster; negative for pumping. By default -1000.0. 
+    baseline_path : Path, optional
+        Path to a baseline simulation with pumping set to 0 to warm-start perturbation simulations from. By default None (i.e., every stress period is simulated).
+
+    Returns
+    -------
+    Dict[int, Path]
+        Cluster ids and their perturbation model workspaces.
+    """
+    nper = model.dis.nper
+    template = model.wel.stress_period_data.get_empty(len(wells))
+    for name in template.dtype.names:
+        if name in wells.columns:
+            template[name] = wells[name].to_numpy()
+
+    scenarios = {}
+    for cluster, cluster_wells in wells.groupby("cluster"):
+        wel_sp = template[cluster_wells.index.to_numpy()].copy()
+        wel_sp["flux"] = unit_flux / len(cluster_wells)
+
+        stress_period_data = {0: 0, start_sp: wel_sp}
+        if start_sp + 1 < nper:
+            stress_period_data[start_sp + 1] = 0
+
+        if baseline_path is not None and start_sp > 0:
+            scenarios[cluster] = write_warm_start_workspace(model,
+                                                            model_ws = Path(model_dir) / f"perturbation_{cluster}",
+                                                            historical_path = baseline_path,
+                                                            start_sp = start_sp,
+                                                            stress_period_data = stress_period_data)
+        else:
+            scenarios[cluster] = write_scenario_workspace(model,
+                                                          model_ws = Path(model_dir) / f"perturbation_{cluster}",
+                                                          stress_period_data = stress_period_data)
+
+    return scenarios
+
+
+def get_qriver_by_sp(points : pd.DataFrame,
+                     model_path : Path,
+                     nper : int,
+                     id : str = "gauge_id") -> np.ndarray:
+    """Get Qriver [ft³/d] at points on the sfr network at the last time step of each stress period.
+
+    Parameters
+    ----------
+    points : pd.DataFrame
+        Points on sfr network; must contain id, "i", and "j" columns.
+    model_path : Path
+        Path to a simulation.
+    nper : int
+        Number of stress periods.
+    id : str, optional
+        id for point's i and j coordinates. By default "gauge_id". 
+
+    Returns
+    -------
+    np.ndarray
+        Qriver with shape (points, stress periods); NaN where no output is saved.
+    """
+    qriver = _get_qriver(points[["i", "j"]].reset_index(drop=True).reset_index(names="point"), model_path, id="point")
+    qriver = qriver[qriver["ts"] == qriver.groupby("sp")["ts"].transform("max")]
+
+    qriver = (qriver.pivot_table(index="point", columns="sp", values="Qriver")
+              .reindex(index=range(len(points)), columns=range(nper)))
+
+    return qriver.to_numpy()
+
+
+def compute_response_functions(points : pd.DataFrame,
+                               wells : pd.DataFrame,
+                               perturbation_paths : Dict[int, Path],
+                               baseline_path : Path,
+                               nper : int,
+                               start_sp : int = 1,
+                               unit_flux : float = -1000.0,
+                               id : str = "gauge_id") -> Dict:
+    """Compute unit response functions of streamflow depletion at points on the sfr network to pumping in each cluster of wells.
+
+    The unit response function of a cluster is the streamflow depletion at each point per unit of flux [ft³/d per ft³/d] in the stress periods after one stress period of pumping, relative to a baseline simulation with pumping set to 0.
+
+    Parameters
+    ----------
+    points : pd.DataFrame
+        Points on sfr network; must contain id, "i", and "j" columns.
+    wells : pd.DataFrame
+        Unique wells and their clusters, as returned by get_wells().
+    perturbation_paths : Dict[int, Path]
+        Cluster ids and paths to their perturbation simulations, as returned by write_perturbation_workspaces().
+    baseline_path : Path
+        Path to a baseline simulation with pumping set to 0.
+    nper : int
+        Number of stress periods.
+    start_sp : int, optional
+        Stress period when pumping starts in perturbation simulations. By default 1.
+    unit_flux : float, optional
+        Total flux [ft³/d] of the wells in a cluster in perturbation simulations. By default -1000.0.
+    id : str, optional
+        id for point's i and j coordinates. By default "gauge_id". 
+
+    Returns
+    -------
+    Dict
+        Response functions with shape (clusters, points, lags) along with the point ids and wells needed to predict streamflow depletion.
+    """
+    clusters = np.sort(wells["cluster"].unique())
+    baseline = get_qriver_by_sp(points, baseline_path, nper, id)[:, start_sp:]
+
+    response = np.zeros((len(clusters), len(points), nper - start_sp), dtype=np.float32)
+    for c, cluster in enumerate(clusters):
+        perturbation = get_qriver_by_sp(points, perturbation_paths[cluster], nper, id)[:, start_sp:]
+        response[c] = np.nan_to_num((perturbation - baseline) / unit_flux)
+
+    return {"response": response,
+            "point_ids": points[id].to_numpy().astype(str),
+            "point_i": points["i"].to_numpy(),
+            "point_j": points["j"].to_numpy(),
+            "wells": wells[["k", "i", "j", "cluster"]].to_numpy(),
+            "clusters": clusters}
+
+
+def save_response_functions(response_functions : Dict, file : Path) -> Path:
+    """Save unit response functions to a compressed .npz file.
+
+    Parameters
+    ----------
+    response_functions : Dict
+        Response functions, as returned by compute_response_functions().
+    file : Path
+        Path to the .npz file.
+
+    Returns
+    -------
+    Path
+        Path to the .npz file.
+    """
+    np.savez_compressed(file, **response_functions)
+    return Path(file)
+
+
+def load_response_functions(file : Path) -> Dict:
+    """Load unit response functions saved with save_response_functions().
+
+    Parameters
+    ----------
+    file : Path
+        Path to the .npz file.
+
+    Returns
+    -------
+    Dict
+        Response functions along with the point ids and wells needed to predict streamflow depletion.
+    """
+    with np.load(file) as f:
+        return {key: f[key] for key in f.files}
+
+
+def get_cluster_schedule(stress_period_data, 
+                         response_functions : Dict,
+                         nper : int) -> np.ndarray:
+    """Get the total flux [ft³/d] of each cluster of wells in each stress period of a WEL schedule.
+
+    Wells that are not in any cluster of the response functions are ignored. 
+
+    Parameters
+    ----------
+    stress_period_data : flopy.utils.MfList
+        WEL stress period data of a scenario (i.e., model.wel.stress_period_data).
+    response_functions : Dict
+        Response functions, as returned by compute_response_functions().
+    nper : int
+        Number of stress periods.
+
+    Returns
+    -------
+    np.ndarray
+        Total flux with shape (clusters, stress periods).
+    """
+    wells = pd.DataFrame(response_functions["wells"], columns=["k", "i", "j", "cluster"])
+    cluster_index = pd.Series(np.arange(len(response_functions["clusters"])), index=response_functions["clusters"])
+    wells["c"] = cluster_index.reindex(wells["cluster"]).to_numpy()
+
+    schedule = np.zeros((len(cluster_index), nper))
+    for sp in range(nper):
+        wel_sp = stress_period_data[sp]
+        if not isinstance(wel_sp, np.recarray) or len(wel_sp) == 0:
+            continue
+        wel_sp = pd.merge(pd.DataFrame({"k": wel_sp["k"], "i": wel_sp["i"], "j": wel_sp["j"], "flux": wel_sp["flux"]}), 
+                          wells, on=["k", "i", "j"], how="inner")
+        np.add.at(schedule[:, sp], wel_sp["c"].to_numpy(), wel_sp["flux"].to_numpy())
+
+    return schedule
+
+
+def predict_streamflow_depletion(response_functions : Dict,
+                                 schedule : np.ndarray,
+                                 id : str = "gauge_id") -> pd.DataFrame:
+    """Predict streamflow depletion at points on the sfr network for a WEL schedule by convolving it with unit response functions.
+
+    Assumes streamflow depletion responds linearly to pumping (i.e., superposition) and that its response does not depend on when pumping occurs.
+
+    Parameters
+    ----------
+    response_functions : Dict
+        Response functions, as returned by compute_response_functions().
+    schedule : np.ndarray
+        Total flux [ft³/d] with shape (clusters, stress periods), as returned by get_cluster_schedule().
+    id : str, optional
+        id for point's i and j coordinates. By default "gauge_id". 
+
+    Returns
+    -------
+    pd.DataFrame
+        Timeseries of predicted streamflow depletion [ft³/d] at points on sfr network for each stress period.
+    """
+    response = response_functions["response"]
+    nper = schedule.shape[1]
+
+    stream_depletion = np.zeros((response.shape[1], nper))
+    for lag in range(min(response.shape[2], nper)):
+        stream_depletion[:, lag:] += response[:, :, lag].T @ schedule[:, :nper - lag]
+
+    return pd.DataFrame({id: np.repeat(response_functions["point_ids"], nper),
+                         "i": np.repeat(response_functions["point_i"], nper),
+                         "j": np.repeat(response_functions["point_j"], nper),
+                         "sp": np.tile(np.arange(nper), len(response_functions["point_ids"])),
+                         "stream_depletion_predicted": stream_depletion.ravel()})
+
+
+def validate_response_functions(response_functions : Dict,
+                                model,
+                                historical_path : Path,
+                                baseline_path : Path,
+                                id : str = "gauge_id") -> pd.DataFrame:
+    """Compare streamflow depletion predicted with unit response functions against depletion estimated from full MODFLOW simulations.
+
+    Parameters
+    ----------
+    response_functions : Dict
+        Response functions, as returned by compute_response_functions().
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with the WEL package of the historical simulation.
+    historical_path : Path
+        Path to a historical simulation with pumping. 
+    baseline_path : Path
+        Path to a baseline simulation with pumping set to 0. 
+    id : str, optional
+        id for point's i and j coordinates. By default "gauge_id". 
+
+    Returns
+    -------
+    pd.DataFrame
+        Timeseries of predicted and simulated streamflow depletion [ft³/d] at points on sfr network for each stress period.
+    """
+    nper = model.dis.nper
+    points = pd.DataFrame({id: response_functions["point_ids"], 
+                           "i": response_functions["point_i"], 
+                           "j": response_functions["point_j"]})
+
+    schedule = get_cluster_schedule(model.wel.stress_period_data, response_functions, nper)
+    predicted = predict_streamflow_depletion(response_functions, schedule, id)
+
+    simulated = get_qriver_by_sp(points, historical_path, nper, id) - get_qriver_by_sp(points, baseline_path, nper, id)
+    predicted["stream_depletion"] = simulated.ravel()
+    predicted["error"] = predicted["stream_depletion_predicted"] - predicted["stream_depletion"]
+
+    metrics = (predicted.dropna(subset=["stream_depletion"])
+               .groupby(id)
+               .apply(lambda x: pd.Series({"rmse": np.sqrt(np.mean(x["error"]**2)), 
+                                           "bias": np.mean(x["error"]),
+                                           "r": np.corrcoef(x["stream_depletion_predicted"], x["stream_depletion"])[0, 1]})))
+    print(f"Response functions vs. MODFLOW streamflow depletion: \n{metrics}")
+
+    return predicted
+
+
+def get_pumping_matrix(model, sparse : bool = False) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Get the fluxes (Qw [ft³/d]) of the WEL package as a matrix of wells x stress periods.
+
+    Built directly from the WEL recarrays, so aggregating, scaling, or exporting pumping does not need a long table of every well in every stress period.
+    Fluxes of wells listed more than once in the same cell and stress period are summed.
+
+    Parameters
+    ----------
+    model : flopy.modflow.Modflow
+        Loaded MODFLOW model with a WEL package.
+    sparse : bool, optional
+        Flag indicating whether to return a sparse matrix (True) that keeps which wells are listed in each stress period, or a dense matrix (False) with 0 for wells that are not listed. By default False.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, np.ndarray]
+        Unique wells with their "k", "i", and "j" columns, and float32 fluxes with shape (wells, stress periods) as a np.ndarray or scipy.sparse.csr_array.
+    """
+    nper = model.dis.nper
+    stress_period_data = model.wel.stress_period_data
+
+    wel_sps = [stress_period_data[sp] for sp in range(nper)]
+    wel_sps = [wel_sp if isinstance(wel_sp, np.recarray) else stress_period_data.get_empty(0) for wel_sp in wel_sps]
+
+    # unique wells, keyed on their layer, row, and column
+    keys = [(wel_sp["k"].astype(np.int64) * model.nrow + wel_sp["i"]) * model.ncol + wel_sp["j"] for wel_sp in wel_sps]
+    unique_keys, well_index = np.unique(np.concatenate(keys), return_inverse=True)
+    wells = pd.DataFrame({"k": unique_keys // (model.nrow * model.ncol),
+                          "i": unique_keys // model.ncol % model.nrow,
+                          "j": unique_keys % model.ncol})
+
+    sp_index = np.repeat(np.arange(nper), [len(key) for key in keys])
+    flux = np.concatenate([wel_sp["flux"] for wel_sp in wel_sps]).astype(np.float32)
+
+    if sparse:
+        from scipy.sparse import coo_array
+
+        return wells, coo_array((flux, (well_index, sp_index)), shape=(len(wells), nper)).tocsr()
+
+    pumping = np.zeros((len(wells), nper), dtype=np.float32)
+    np.add.at(pumping, (well_index, sp_index), flux)
+
+    return wells, pumping
+
+
+def get_watershed_membership(x : np.ndarray,
+                             y : np.ndarray,
+                             watersheds,
+                             ids : List[str],
+                             id : str = "gauge_id"):
+    """Get which wells are within each watershed as a sparse membership matrix of watersheds x wells.
+
+    The spatial join is done once on the unique well locations with an STRtree, so time series of pumping in each watershed are a single sparse matrix product (e.g., membership @ Qwel for Qwel from get_pumping_matrix()).
+
+    Parameters
+    ----------
+    x : np.ndarray
+        x coordinates of wells, in the same coordinate system as watersheds.
+    y : np.ndarray
+        y coordinates of wells.
+    watersheds : gpd.GeoDataFrame
+        Watershed polygons; must contain an id column. Watersheds with more than one polygon are merged.
+    ids : List[str]
+        Watershed ids, in the order of the rows of the membership matrix.
+    id : str, optional
+        id for watersheds. By default "gauge_id".
+
+    Returns
+    -------
+    csr_array
+        float32 membership matrix with shape (watersheds, wells) that is 1 for wells within each watershed.
+    """
+    import shapely
+    from scipy.sparse import coo_array
+
+    wells = shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+    tree = shapely.STRtree(wells)
+
+    # same as gpd.sjoin(..., predicate="within") of wells on watersheds
+    polygon_index, well_index = tree.query(watersheds.geometry.to_numpy(), predicate="contains")
+
+    watershed_index = pd.Series(np.arange(len(ids)), index=pd.Index(ids)).reindex(watersheds[id].to_numpy()[polygon_index]).to_numpy()
+    in_ids = ~np.isnan(watershed_index)
+
+    membership = coo_array((np.ones(in_ids.sum(), dtype=np.float32), (watershed_index[in_ids].astype(np.int64), well_index[in_ids])), 
+                           shape=(len(ids), len(wells))).tocsr()
+    membership.data[:] = 1.0
+
+    return membership
+
+
+def load_model(namefile : str,
+               model_ws : Path,
+               load_only : List[str] = None,
+               exe_name : Path = "mf2005",
+               version : str = "mf2005",
+               snapshot : bool = True):
+    """Load a MODFLOW model with only the packages needed, from a binary snapshot when its input files have not changed.
+
+    The first load parses the packages with FloPy's flopy.modflow.Modflow.load() and pickles the loaded model to ".snapshots" in model_ws.
+    Snapshots are keyed by the hashes of the name file and the input files of the loaded packages (see _get_file_hash()), so later loads only unpickle the model.
+    Files referenced from within package files (e.g., OPEN/CLOSE arrays) are not part of the key.
+
+    Parameters
+    ----------
+    namefile : str
+        MODFLOW name file (e.g., "trans_2d.nam").
+    model_ws : Path
+        Model workspace.
+    load_only : List[str], optional
+        Packages to load (e.g., ["DIS", "SFR", "WEL"]). By default None (i.e., all packages).
+    exe_name : Path, optional
+        Path to the MODFLOW executable. By default "mf2005".
+    version : str, optional
+        MODFLOW version. By default "mf2005".
+    snapshot : bool, optional
+        Flag indicating whether to load from and save to a snapshot. By default True.
+
+    Returns
+    -------
+    flopy.modflow.Modflow
+        Loaded MODFLOW model.
+    """
+    import hashlib
+    import pickle
+    import flopy
 
+    model_ws = Path(model_ws)
+    if load_only is not None:
+        load_only = sorted(package.upper() for package in load_only)
 
+    if not snapshot:
+        return flopy.modflow.Modflow.load(namefile, model_ws=model_ws, exe_name=exe_name, version=version, load_only=load_only)
 
+    # input files of the loaded packages
+    files = [("NAM", namefile)]
+    with open(model_ws / namefile, "r") as f:
+        for line in f:
+            entry = line.split()
+            if len(entry) < 3 or entry[0].startswith("#") or entry[0].upper() == "LIST" or entry[0].upper().startswith("DATA"):
+                continue
+            if load_only is None or entry[0].upper() in load_only:
+                files.append((entry[0].upper(), entry[2]))
 
+    snapshot_dir = model_ws / ".snapshots"
+    key = hashlib.sha256(repr((flopy.__version__, version, load_only, [(ftype, _get_file_hash(model_ws / file, snapshot_dir)) for ftype, file in files])).encode())
+    snapshot_file = snapshot_dir / f"{key.hexdigest()}.pkl"
 
+    if snapshot_file.exists():
+        with open(snapshot_file, "rb") as f:
+            model = pickle.load(f)
+        model.change_model_ws(new_pth = model_ws)
+        model.exe_name = exe_name
+        return model
 
+    model = flopy.modflow.Modflow.load(namefile, model_ws=model_ws, exe_name=exe_name, version=version, load_only=load_only)
 
+    # write to a temporary file first so an interrupted write is never mistaken for a snapshot
+    tmp_file = snapshot_dir / f"{key.hexdigest()}.tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_file.replace(snapshot_file)
 
+    return model